@@ -0,0 +1,145 @@
+"""
+Snap providers for the DM optimizer: callables snap(not_before) returning a camera image
+acquired after time.perf_counter() reached not_before (i.e. after the mirror settled).
+by @nvladimus, 2020
+"""
+import time
+import numpy as np
+import optimization
+
+
+def sleeping_snapper(cam_handle=None, simulation=None):
+    """Return snap(not_before) function: wait until time.perf_counter() reaches not_before, then snap a full frame.
+    In simulation mode, returns a random image, as wiggle_mirror_snap_rois_2views()."""
+    def snap(not_before=None):
+        if not_before is not None:
+            time.sleep(max(0, not_before - time.perf_counter()))
+        if simulation is not None and simulation.on:
+            return np.random.rand(2048, 2048)
+        return optimization.snap_image(cam_handle=cam_handle)
+    return snap
+
+
+def rows_covering_rois(roi_centers, roi_height, margin_px=0):
+    """Band of sensor rows (v_pos, v_size) covering all ROIs centered at roi_centers [(x, y), ...],
+    plus margin_px above and below, e.g. for bead drift during tracking."""
+    y = np.array([center[1] for center in roi_centers])
+    v_pos = int(np.floor(y.min() - roi_height / 2 - margin_px))
+    v_end = int(np.ceil(y.max() + roi_height / 2 + margin_px))
+    return v_pos, v_end - v_pos
+
+
+class StreamingSnapper:
+    """
+    Camera streaming in sequence mode ('run_till_abort') into a small ring buffer, without start/stop per snap.
+    A snap returns the first frame exposed after not_before, selected by the DCAM frame time stamps,
+    so the latency after the mirror settles is about one frame time, and only the selected frame is copied.
+    The DCAM clock is mapped to time.perf_counter() by the smallest observed delay between a frame time stamp
+    and its arrival, so frame times are estimated late by at most this transfer latency.
+    Usage:
+        with StreamingSnapper(cam_handle) as snap:
+            image = snap(time.perf_counter() + settle_time_s)
+    """
+    def __init__(self, cam_handle, ring_buffer_frames=16, timeout_s=1.0, n_calibration_frames=5):
+        """
+        :param cam_handle: hamamatsu_camera.HamamatsuCamera
+        :param ring_buffer_frames: int, number of camera buffers. Older frames are overwritten.
+        :param timeout_s: float, max wait for a frame.
+        :param n_calibration_frames: int, frames used to map the DCAM clock at start().
+        """
+        self.cam_handle = cam_handle
+        self.ring_buffer_frames = ring_buffer_frames
+        self.timeout_s = timeout_s
+        self.n_calibration_frames = n_calibration_frames
+        self.row_offset = 0
+        self.frame_time_s = None
+        self.clock_offset_s = None
+        self.running = False
+
+    def start(self):
+        """Start streaming, and map the DCAM clock to time.perf_counter()."""
+        self.cam_handle.setACQMode("run_till_abort", number_frames=self.ring_buffer_frames)
+        self.cam_handle.warn_overrun = False  # old frames are intentionally overwritten
+        self.cam_handle.startAcquisition()
+        # a frame arriving at time t was exposed within [t - frame_time_s, t]
+        self.frame_time_s = self.cam_handle.getPropertyValue("exposure_time")[0] \
+            + self.cam_handle.getPropertyValue("timing_readout_time")[0]
+        self.clock_offset_s = None
+        self.running = True
+        for i in range(self.n_calibration_frames):
+            new_frames = self.cam_handle.newFrames()
+            if len(new_frames) > 0:
+                self._update_clock_offset(new_frames[-1])
+
+    def _update_clock_offset(self, frame_id):
+        """Update clock offset from the newest (just arrived) frame. Returns the frame time stamp."""
+        timestamp = self.cam_handle.getFrameTimestamp(frame_id)
+        offset = time.perf_counter() - timestamp
+        if self.clock_offset_s is None or offset < self.clock_offset_s:
+            self.clock_offset_s = offset
+        return timestamp
+
+    def __call__(self, not_before=None):
+        """Return the first frame exposed entirely after not_before (time.perf_counter() units)."""
+        if not self.running:
+            raise ValueError("Error in snap(): call start() first.")
+        if not_before is None:
+            not_before = time.perf_counter()
+        t_timeout = max(not_before, time.perf_counter()) + self.frame_time_s + self.timeout_s
+        while time.perf_counter() < t_timeout:
+            new_frames = self.cam_handle.newFrames()
+            if len(new_frames) == 0:
+                continue
+            self._update_clock_offset(new_frames[-1])
+            for frame_id in new_frames:
+                exposure_start = self.cam_handle.getFrameTimestamp(frame_id) + self.clock_offset_s \
+                                 - self.frame_time_s
+                if exposure_start >= not_before:
+                    return self.cam_handle.getFrame(frame_id)
+        raise ValueError("Error in snap(): no camera frame within timeout.")
+
+    def stop(self):
+        """Stop streaming."""
+        if self.running:
+            self.cam_handle.stopAcquisition()
+            self.cam_handle.warn_overrun = True
+            self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class SubarraySnapper(StreamingSnapper):
+    """
+    StreamingSnapper reading out only the band of rows covering the bead ROIs.
+    Readout time and data volume per frame shrink in proportion to the band height (e.g. 2048 -> 128 rows).
+    Images are returned in band coordinates: sensor row = image row + self.row_offset.
+    """
+    def __init__(self, cam_handle, roi_centers, roi_height, margin_px=32, **kwargs):
+        """
+        :param cam_handle: hamamatsu_camera.HamamatsuCamera
+        :param roi_centers: [(x, y), ...] ROI centers in full sensor coordinates, px.
+        :param roi_height: int, px
+        :param margin_px: int, extra rows above and below ROIs, to allow for bead tracking.
+        :param kwargs: see StreamingSnapper
+        """
+        super().__init__(cam_handle, **kwargs)
+        self.v_pos, self.v_size = rows_covering_rois(roi_centers, roi_height, margin_px)
+        self.full_rows = None
+
+    def start(self):
+        """Set the subarray and start streaming."""
+        self.full_rows = (self.cam_handle.getPropertyValue("subarray_vpos")[0],
+                          self.cam_handle.getPropertyValue("subarray_vsize")[0])
+        self.row_offset, self.v_size = self.cam_handle.setSubArrayRows(self.v_pos, self.v_size)
+        super().start()
+
+    def stop(self):
+        """Stop streaming and restore the previous subarray rows."""
+        if self.running:
+            super().stop()
+            self.cam_handle.setSubArrayRows(*self.full_rows)
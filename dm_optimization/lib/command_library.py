@@ -0,0 +1,120 @@
+"""
+Library of optimized DM commands indexed by imaging conditions, for warm-starting the optimization.
+Conditions are a flat dictionary, e.g. {'chamber': 'water', 'coverslip_tilt_deg': 0.0, 'wavelength_nm': 488,
+'etl_current_mA': 12.5, 'stage_x_mm': 1.2, 'stage_y_mm': -0.4}. Text conditions must match exactly,
+numeric conditions are compared by distance in units of their scale.
+by @nvladimus, 2020
+"""
+import os
+import json
+import time
+import numpy as np
+
+DEFAULT_SCALES = {'coverslip_tilt_deg': 1.0, 'wavelength_nm': 50.0, 'etl_current_mA': 10.0,
+                  'stage_x_mm': 1.0, 'stage_y_mm': 1.0, 'stage_z_mm': 0.1}
+
+
+class CommandLibrary:
+    """DM commands with their imaging conditions and final metric, stored in a JSON file."""
+    def __init__(self, path, scales=None):
+        """
+        :param path: str, JSON file, created at the first add().
+        :param scales: dictionary {condition: scale}, distance of numeric conditions is measured in these units.
+            DEFAULT_SCALES by default, conditions not listed have scale 1.
+        """
+        self.path = path
+        self.scales = dict(DEFAULT_SCALES) if scales is None else dict(scales)
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def add(self, command, conditions, metric, metric_name=None, serial=None, comment=''):
+        """Add the command optimized under conditions, with its final metric (lower is better), and save."""
+        entry = {'id': max([e['id'] for e in self.entries], default=0) + 1,
+                 'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+                 'conditions': dict(conditions),
+                 'metric': float(metric),
+                 'metric_name': metric_name,
+                 'serial': serial,
+                 'comment': comment,
+                 'command': [float(v) for v in command]}
+        self.entries.append(entry)
+        self.save()
+        return entry['id']
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        path_tmp = self.path + '.tmp'
+        with open(path_tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(path_tmp, self.path)  # the library is not lost if writing fails
+
+    def distance(self, conditions_a, conditions_b):
+        """Distance between condition sets: inf if text conditions differ,
+        otherwise Euclidean distance of numeric conditions in units of their scales.
+        Conditions missing from one of the sets are ignored."""
+        d2 = 0.0
+        for key in set(conditions_a) & set(conditions_b):
+            a, b = conditions_a[key], conditions_b[key]
+            if isinstance(a, str) or isinstance(b, str):
+                if a != b:
+                    return np.inf
+            elif a is not None and b is not None:
+                d2 += float(np.sum(((np.asarray(a, dtype=float) - np.asarray(b, dtype=float))
+                                    / self.scales.get(key, 1.0)) ** 2))
+        return np.sqrt(d2)
+
+    def closest(self, conditions, serial=None, metric_name=None, max_distance=np.inf):
+        """
+        Entry optimized under the conditions closest to the given ones, the best metric among equally close.
+        Parameters:
+            :param conditions: dictionary
+            :param serial: str, only entries of this mirror serial, or None for all.
+            :param metric_name: str, only entries with this metric, or None for all.
+            :param max_distance: float, in units of condition scales.
+        Returns
+            (command array, entry dictionary), or (None, None) if no entry is close enough.
+        """
+        candidates = [e for e in self.entries
+                      if (serial is None or e['serial'] == serial)
+                      and (metric_name is None or e['metric_name'] == metric_name)]
+        best, best_key = None, (np.inf, np.inf)
+        for entry in candidates:
+            key = (self.distance(conditions, entry['conditions']), entry['metric'])
+            if np.isfinite(key[0]) and key[0] <= max_distance and key < best_key:
+                best, best_key = entry, key
+        if best is None:
+            return None, None
+        return np.array(best['command']), best
+
+
+def optimize_warm_started(optimizer, evaluate, library, conditions, default_command, serial=None,
+                          max_distance=np.inf, comment=''):
+    """
+    Optimize starting from the library command closest to conditions (default_command if there is none),
+    and add the result to the library.
+    Parameters:
+        :param optimizer: optimizers.Optimizer
+        :param evaluate: optimizers.Evaluator
+        :param library: CommandLibrary
+        :param conditions: dictionary
+        :param default_command: array, e.g. flat command.
+        :param serial: str, mirror serial.
+        :param max_distance: float, see CommandLibrary.closest()
+        :param comment: str
+    Returns
+        (best command, id of the new library entry)
+    """
+    metric_name = evaluate.metric_settings.method1
+    command, entry = library.closest(conditions, serial, metric_name, max_distance)
+    if command is None:
+        command = np.asarray(default_command)
+    else:
+        comment = f"warm start from #{entry['id']}. " + comment
+    command_best = optimizer.run(evaluate, command)
+    entry_id = library.add(command_best, conditions, evaluate.best_metric, metric_name, serial,
+                           comment + f"{optimizer.name}, {evaluate.n_snaps} snaps")
+    return command_best, entry_id
@@ -0,0 +1,91 @@
+"""
+Position-dependent DM correction: commands optimized at a sparse set of stage positions,
+interpolated at the position of each tile (scan line) of an acquisition.
+by @nvladimus, 2020
+"""
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator, NearestNDInterpolator
+import optimization
+
+
+class CorrectionMap:
+    """
+    Interpolation of DM commands over stage positions (x, y), mm.
+    Linear interpolation within the triangulation of the positions, nearest command outside of it.
+    If the positions lie on a line (e.g. along a row of tiles), interpolation is linear along that line.
+    """
+    def __init__(self, positions, commands):
+        """
+        :param positions: (n, 2) array of stage (x, y), mm.
+        :param commands: (n, n_actuators) array of DM commands optimized at the positions.
+        """
+        self.positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+        self.commands = np.atleast_2d(np.asarray(commands, dtype=np.float64))
+        if self.positions.shape[0] != self.commands.shape[0]:
+            raise ValueError("Number of positions and commands must be equal.")
+        self._nearest = NearestNDInterpolator(self.positions, self.commands) if len(self.positions) > 1 else None
+        self._linear = None
+        self._line = None
+        if len(self.positions) >= 2:
+            centered = self.positions - self.positions.mean(axis=0)
+            _, s, vt = np.linalg.svd(centered, full_matrices=False)
+            if len(self.positions) >= 3 and s[1] > 1e-6 * s[0]:
+                self._linear = LinearNDInterpolator(self.positions, self.commands)
+            else:  # collinear positions: interpolate along the line
+                self._line = vt[0]
+                t = centered @ self._line
+                order = np.argsort(t)
+                self._line_t, self._line_commands = t[order], self.commands[order]
+
+    @classmethod
+    def from_library(cls, library, conditions, serial=None, metric_name=None, max_distance=np.inf):
+        """
+        Map of the command at each stage position in a command_library.CommandLibrary,
+        among entries whose other conditions (e.g. chamber, wavelength) are within max_distance of the given ones.
+        At each position, the closest conditions win, then the best metric, as in CommandLibrary.closest().
+        :param max_distance: float, in units of condition scales, e.g. config.dm_library['max_distance'].
+        Returns None if the library has no such entries with stage positions.
+        """
+        conditions = {key: value for key, value in conditions.items() if not key.startswith('stage_')}
+        best = {}
+        for entry in library.entries:
+            if 'stage_x_mm' not in entry['conditions'] or 'stage_y_mm' not in entry['conditions']:
+                continue
+            if (serial is not None and entry['serial'] != serial) \
+                    or (metric_name is not None and entry['metric_name'] != metric_name):
+                continue
+            distance = library.distance(conditions, entry['conditions'])
+            if not np.isfinite(distance) or distance > max_distance:
+                continue
+            position = (round(entry['conditions']['stage_x_mm'], 3), round(entry['conditions']['stage_y_mm'], 3))
+            key = (distance, entry['metric'])
+            if position not in best or key < best[position][0]:
+                best[position] = (key, entry)
+        if len(best) == 0:
+            return None
+        return cls(list(best.keys()), [entry['command'] for _, entry in best.values()])
+
+    def command_at(self, x, y):
+        """Interpolated command at stage position (x, y), mm."""
+        if len(self.positions) == 1:
+            return self.commands[0].copy()
+        if self._line is not None:
+            t = (np.array([x, y]) - self.positions.mean(axis=0)) @ self._line
+            return np.array([np.interp(t, self._line_t, c) for c in self._line_commands.T])
+        command = self._linear([(x, y)])[0]
+        if np.any(np.isnan(command)):
+            command = self._nearest([(x, y)])[0]
+        return command
+
+    def tile_commands(self, tile_positions):
+        """
+        Commands for a sequence of tiles (scan lines), checked for safe voltage.
+        :param tile_positions: list of (x, y) stage positions, mm.
+        Returns
+            (n_tiles, n_actuators) array.
+        """
+        commands = np.array([self.command_at(x, y) for x, y in tile_positions])
+        for i, command in enumerate(commands):
+            if not optimization.safe_voltage(command):
+                raise ValueError(f"Interpolated command of tile {i} is outside of safe range.")
+        return commands
@@ -0,0 +1,221 @@
+"""
+Simulated deformable mirror and camera for offline, reproducible benchmarks of the optimizers.
+The DM command is mapped through a synthetic influence matrix to Zernike coefficients of the pupil phase,
+added to the sample aberration of each bead, and the bead images are computed by FFT of the pupil field.
+SimulatedMirror.apply_command and SimulatedCamera (snap(not_before) callable) plug into optimizers.Evaluator
+and spgd.PipelinedSPGD in place of spgd.dll_command_applier() and camera_snap snappers, with simulation=None:
+    mirror = SimulatedMirror(seed=1)
+    camera = SimulatedCamera(mirror, bead_positions=[(512, 1050), (1536, 1050)], seed=1)
+    evaluate = optimizers.Evaluator(mirror.apply_command, camera, metric_settings, camera.bead_positions,
+                                    settle_time_s=0)
+Units: phase in radians, image coordinates in px (x, y), first pixel center at 0.5.
+by @nvladimus, 2020
+"""
+import numpy as np
+import mirao52_utils
+import optimizers
+
+
+def zernike_pupil_stack(n_modes, pupil_px):
+    """
+    Zernike modes of Noll indices 1..n_modes sampled on a square grid of pupil_px across the pupil diameter.
+    Returns
+        (zernikes, aperture): (n_modes, pupil_px, pupil_px) array, zero outside of the pupil,
+            and boolean (pupil_px, pupil_px) aperture mask.
+    """
+    coords = (np.arange(pupil_px) + 0.5) / pupil_px * 2 - 1
+    x, y = np.meshgrid(coords, coords)
+    rho, theta = np.hypot(x, y), np.arctan2(y, x)
+    aperture = rho <= 1.0
+    zernikes = np.array([optimizers.zernike_noll(j, rho, theta) * aperture for j in range(1, n_modes + 1)])
+    return zernikes, aperture
+
+
+def synthetic_influence_matrix(n_modes=21, coupling=0.15, stroke_rad=6.0, gain_spread=0.1, pupil_px=64, seed=0):
+    """
+    Influence matrix of a Mirao52e-like mirror, from Gaussian actuator influence functions projected onto Zernike modes.
+    Parameters:
+        :param n_modes: int, Zernike modes (Noll 1..n_modes).
+        :param coupling: float, influence of an actuator at the position of its nearest neighbor (pitch 1/4 radius).
+        :param stroke_rad: float, peak pupil phase of one actuator at command 1.
+        :param gain_spread: float, relative random variation of actuator gains.
+        :param pupil_px: int, sampling of the projection.
+        :param seed: int
+    Returns
+        (n_modes, 52) array, Zernike coefficients (rad RMS) per unit command of each actuator.
+    """
+    rs = np.random.RandomState(seed)
+    zernikes, aperture = zernike_pupil_stack(n_modes, pupil_px)
+    positions = mirao52_utils.actuator_positions()
+    coords = (np.arange(pupil_px) + 0.5) / pupil_px * 2 - 1
+    x, y = np.meshgrid(coords, coords)
+    width2 = 0.25 ** 2 / (-2 * np.log(coupling))
+    gains = stroke_rad * (1 + gain_spread * rs.randn(len(positions)))
+    dist2 = (x[None] - positions[:, 0, None, None]) ** 2 + (y[None] - positions[:, 1, None, None]) ** 2
+    influence_functions = gains[:, None, None] * np.exp(-dist2 / (2 * width2))
+    # least-squares projection over the aperture
+    z = zernikes[:, aperture].T
+    f = influence_functions[:, aperture].T
+    return np.linalg.lstsq(z, f, rcond=None)[0]
+
+
+def random_aberration(n_modes=21, rms_rad=1.0, seed=0, first_mode=5):
+    """Zernike coefficients of a random aberration with total RMS rms_rad over modes first_mode..n_modes
+    (default: no piston, tip, tilt and defocus), amplitude falling off with the radial order."""
+    rs = np.random.RandomState(seed)
+    coeffs = np.zeros(n_modes)
+    j = np.arange(first_mode, n_modes + 1)
+    radial_order = np.ceil((-3 + np.sqrt(9 + 8 * (j - 1))) / 2)
+    coeffs[first_mode - 1:] = rs.randn(len(j)) / radial_order
+    return coeffs * rms_rad / np.linalg.norm(coeffs)
+
+
+def random_bead_positions(n_beads, image_shape=(2048, 2048), margin_px=100, min_separation_px=60, seed=0,
+                          region=None):
+    """Random (x, y) bead positions, px, at least min_separation_px apart and margin_px from the border
+    of region (x, y, width, height), the whole image by default."""
+    rs = np.random.RandomState(seed)
+    x0, y0, w, h = (0, 0, image_shape[1], image_shape[0]) if region is None else region
+    positions = []
+    for i in range(100 * n_beads):
+        if len(positions) == n_beads:
+            break
+        p = rs.uniform([x0 + margin_px, y0 + margin_px], [x0 + w - margin_px, y0 + h - margin_px])
+        if all(np.hypot(*(p - q)) >= min_separation_px for q in positions):
+            positions.append(p)
+    return [tuple(p) for p in positions]
+
+
+class SimulatedMirror:
+    """DM model: command -> Zernike coefficients of the pupil phase, via the influence matrix."""
+    def __init__(self, influence_matrix=None, n_modes=21, seed=0):
+        """
+        :param influence_matrix: (n_modes, n_actuators) array, synthetic_influence_matrix(n_modes, seed) by default.
+        :param n_modes: int, used if influence_matrix is None.
+        :param seed: int
+        """
+        self.influence_matrix = synthetic_influence_matrix(n_modes, seed=seed) if influence_matrix is None \
+            else np.asarray(influence_matrix)
+        self.n_modes, self.n_actuators = self.influence_matrix.shape
+        self.command = np.zeros(self.n_actuators)
+        self.n_commands = 0
+
+    def apply_command(self, cmd):
+        cmd = np.asarray(cmd, dtype=np.float64)
+        if cmd.shape != (self.n_actuators,):
+            raise ValueError(f"Command must have {self.n_actuators} values.")
+        self.command = cmd.copy()
+        self.n_commands += 1
+
+    def zernike_coefficients(self, cmd=None):
+        """Pupil phase added by the command (current one by default), as Zernike coefficients, rad RMS."""
+        return self.influence_matrix @ (self.command if cmd is None else np.asarray(cmd))
+
+
+class SimulatedCamera:
+    """
+    Camera imaging beads through the aberrated pupil and the SimulatedMirror.
+    The pupil field of each bead is exp(i * (aberration + mirror phase + subpixel shift ramp)) over the aperture,
+    all beads are propagated by a single batched FFT, and the PSFs of the last commands are cached.
+    Photon shot noise, background and read noise are drawn from a seeded generator, so runs are reproducible.
+    For speed, fresh noise is drawn only within the crops around the beads, the rest of the frame
+    is one of n_noise_frames background frames drawn at start.
+    """
+    def __init__(self, mirror, bead_positions, aberration=None, view_aberrations=None, field_gradient=None,
+                 image_shape=(2048, 2048), pupil_px=32, fft_px=128, crop_px=128, n_photons=2e4,
+                 background=10.0, offset=100.0, read_noise=1.5, seed=0, cache_size=16, n_noise_frames=4):
+        """
+        :param mirror: SimulatedMirror
+        :param bead_positions: [(x, y), ...] px.
+        :param aberration: (n_modes,) Zernike coefficients of the sample aberration, rad RMS,
+            random_aberration(mirror.n_modes, seed=seed) by default.
+        :param view_aberrations: dictionary {bead index: (n_modes,) extra coefficients}, e.g. differences between
+            the left and right view.
+        :param field_gradient: (n_modes, 2) array, change of the coefficients per image half-width along x and y,
+            for field-dependent aberrations.
+        :param image_shape: (height, width) px.
+        :param pupil_px: int, pupil diameter in FFT samples. PSF FWHM is about fft_px / pupil_px px.
+        :param fft_px: int, FFT size.
+        :param crop_px: int, size of the PSF crop added to the image around each bead, <= fft_px.
+            ROIs larger than the crop see static background noise at their edges.
+        :param n_photons: float, photons per bead.
+        :param background: float, background photons per px.
+        :param offset: float, camera offset, counts.
+        :param read_noise: float, electrons RMS.
+        :param seed: int
+        :param cache_size: int, number of commands with cached PSFs.
+        :param n_noise_frames: int
+        """
+        self.mirror = mirror
+        self.bead_positions = [tuple(p) for p in bead_positions]
+        self.image_shape = tuple(image_shape)
+        self.pupil_px, self.fft_px, self.crop_px = pupil_px, fft_px, crop_px
+        self.n_photons, self.background, self.offset, self.read_noise = n_photons, background, offset, read_noise
+        self.rs = np.random.RandomState(seed)
+        self.cache_size = cache_size
+        self.cache = {}
+        self.row_offset = 0
+        noise_sigma = np.sqrt(background + read_noise ** 2)
+        self.noise_frames = [np.clip(np.round(self.rs.normal(offset + background, noise_sigma, self.image_shape)),
+                                     0, 65535).astype(np.uint16) for i in range(n_noise_frames)]
+        self.signal = np.zeros(self.image_shape, dtype=np.float64)
+        self.zernikes, self.aperture = zernike_pupil_stack(mirror.n_modes, pupil_px)
+        n_beads = len(self.bead_positions)
+        aberration = random_aberration(mirror.n_modes, seed=seed) if aberration is None else np.asarray(aberration)
+        self.bead_aberrations = np.tile(aberration, (n_beads, 1))
+        if view_aberrations is not None:
+            for i_bead, coeffs in view_aberrations.items():
+                self.bead_aberrations[i_bead] += coeffs
+        if field_gradient is not None:
+            half_size = np.array(self.image_shape[::-1]) / 2
+            field = (np.array(self.bead_positions) - half_size) / half_size
+            self.bead_aberrations += field @ np.asarray(field_gradient).T
+        # integer position of each PSF crop, and the phase ramp shifting the PSF by the subpixel remainder
+        positions = np.array(self.bead_positions) - 0.5
+        self.crop_origins = np.round(positions).astype(int) - crop_px // 2
+        shifts = positions - np.round(positions)
+        k = 2 * np.pi * (np.arange(pupil_px) - pupil_px / 2 + 0.5) / fft_px
+        self.shift_ramps = shifts[:, 0, None, None] * k[None, None, :] + shifts[:, 1, None, None] * k[None, :, None]
+
+    def psfs(self, cmd=None):
+        """PSF crops (n_beads, crop_px, crop_px) of the current (or given) mirror command, normalized to sum 1."""
+        cmd = self.mirror.command if cmd is None else np.asarray(cmd, dtype=np.float64)
+        key = cmd.tobytes()
+        if key in self.cache:
+            return self.cache[key]
+        coeffs = self.bead_aberrations + self.mirror.zernike_coefficients(cmd)
+        phase = np.tensordot(coeffs, self.zernikes, axes=(1, 0)) + self.shift_ramps
+        field = np.zeros((len(coeffs), self.fft_px, self.fft_px), dtype=np.complex64)
+        field[:, :self.pupil_px, :self.pupil_px] = self.aperture * np.exp(1j * phase)
+        psfs = np.abs(np.fft.fftshift(np.fft.fft2(field), axes=(1, 2))) ** 2
+        c0 = self.fft_px // 2 - self.crop_px // 2
+        psfs = psfs[:, c0:c0 + self.crop_px, c0:c0 + self.crop_px]
+        psfs /= psfs.sum(axis=(1, 2), keepdims=True)
+        if len(self.cache) >= self.cache_size:
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[key] = psfs
+        return psfs
+
+    def strehl_ratios(self, cmd=None):
+        """Strehl ratio of each bead: exp(-phase variance), from the residual Zernike coefficients
+        (excluding piston, tip and tilt)."""
+        coeffs = self.bead_aberrations + self.mirror.zernike_coefficients(cmd)
+        return np.exp(-np.sum(coeffs[:, 3:] ** 2, axis=1))
+
+    def __call__(self, not_before=None):
+        """Snap an image with the current mirror command. Time is simulated, so not_before is ignored."""
+        image = self.noise_frames[self.rs.randint(len(self.noise_frames))].copy()
+        h, w = self.image_shape
+        regions = []
+        for psf, (x0, y0) in zip(self.psfs(), self.crop_origins):
+            xs, ys = slice(max(x0, 0), min(x0 + self.crop_px, w)), slice(max(y0, 0), min(y0 + self.crop_px, h))
+            self.signal[ys, xs] += self.n_photons * psf[ys.start - y0:ys.stop - y0, xs.start - x0:xs.stop - x0]
+            regions.append((ys, xs))
+        # overlapping crops are drawn again, with the signal of all beads
+        for ys, xs in regions:
+            expected = self.background + self.signal[ys, xs]
+            noisy = self.rs.poisson(expected) + self.offset + self.read_noise * self.rs.randn(*expected.shape)
+            image[ys, xs] = np.clip(np.round(noisy), 0, 65535)
+        for ys, xs in regions:
+            self.signal[ys, xs] = 0
+        return image
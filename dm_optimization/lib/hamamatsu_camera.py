@@ -129,6 +129,14 @@ class DCAMBUF_ATTACH(ctypes.Structure):
             ("buffer", ctypes.POINTER(ctypes.c_void_p)),
             ("buffercount", ctypes.c_int32)]
 
+## DCAM_TIMESTAMP
+#
+# The dcam frame time stamp structure
+#
+class DCAM_TIMESTAMP(ctypes.Structure):
+    _fields_ = [("sec", ctypes.c_uint32),
+            ("microsec", ctypes.c_int32)]
+
 ## DCAMBUF_FRAME
 #
 # The dcam buffer frame structure
@@ -145,7 +153,7 @@ class DCAMBUF_FRAME(ctypes.Structure):
             ("height", ctypes.c_int32),
             ("left", ctypes.c_int32),
             ("top", ctypes.c_int32),
-            ("timestamp", ctypes.c_int32),
+            ("timestamp", DCAM_TIMESTAMP),
             ("framestamp", ctypes.c_int32),
             ("camerastamp", ctypes.c_int32)]
 
@@ -265,6 +273,7 @@ class HamamatsuCamera(object):
         self.properties = None
         self.max_backlog = 0
         self.number_image_buffers = 0
+        self.warn_overrun = True
 
         self.acquisition_mode = "run_till_abort"
         self.number_frames = 0
@@ -389,14 +398,8 @@ class HamamatsuCamera(object):
         """
         frames = []
         for n in self.newFrames():
-            paramlock = DCAMBUF_FRAME(
-                    0, 0, 0, n, None, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-            paramlock.size = ctypes.sizeof(paramlock)
-
             # Lock the frame in the camera buffer & get address.
-            self.checkStatus(dcam.dcambuf_lockframe(self.camera_handle,
-                                                ctypes.byref(paramlock)),
-                             "dcambuf_lockframe")
+            paramlock = self.lockFrame(n)
 
             # Create storage for the frame & copy into this storage.
             hc_data = HCamData(self.frame_bytes)
@@ -405,6 +408,35 @@ class HamamatsuCamera(object):
 
         return [frames, [self.frame_y, self.frame_x]]
 
+    def lockFrame(self, frame_id):
+        """
+        Lock the frame in the camera buffer, return its DCAMBUF_FRAME (address, time stamp etc.).
+        """
+        paramlock = DCAMBUF_FRAME(
+                0, 0, 0, frame_id, None, 0, 0, 0, 0, 0, 0, DCAM_TIMESTAMP(0, 0), 0, 0)
+        paramlock.size = ctypes.sizeof(paramlock)
+        self.checkStatus(dcam.dcambuf_lockframe(self.camera_handle,
+                                            ctypes.byref(paramlock)),
+                         "dcambuf_lockframe")
+        return paramlock
+
+    def getFrame(self, frame_id):
+        """
+        Copy the frame frame_id out of the camera buffer, as 2D array.
+        """
+        paramlock = self.lockFrame(frame_id)
+        hc_data = HCamData(self.frame_bytes)
+        hc_data.copyData(paramlock.buf)
+        return numpy.reshape(hc_data.getData(), (self.frame_y, self.frame_x))
+
+    def getFrameTimestamp(self, frame_id):
+        """
+        Time stamp of the frame frame_id in the camera buffer, s, without copying the frame.
+        The time stamp is taken by the DCAM driver, in its own clock.
+        """
+        timestamp = self.lockFrame(frame_id).timestamp
+        return timestamp.sec + 1e-6 * timestamp.microsec
+
     def getModelInfo(self, camera_id):
         """
         Returns the model of the camera
@@ -622,7 +654,7 @@ class HamamatsuCamera(object):
         # Check that we have not acquired more frames than we can store in our buffer.
         # Keep track of the maximum backlog.
         backlog = cur_frame_number - self.last_frame_number
-        if backlog > self.number_image_buffers:
+        if backlog > self.number_image_buffers and self.warn_overrun:
             print(">> Warning! hamamatsu camera frame buffer overrun detected!")
         if (backlog > self.max_backlog):
             self.max_backlog = backlog
@@ -700,13 +732,39 @@ class HamamatsuCamera(object):
         else:
             self.setPropertyValue("subarray_mode", "ON")
 
+    def setSubArrayRows(self, v_pos, v_size, row_step = 4):
+        """
+        Read out only the band of sensor rows [v_pos, v_pos + v_size), at full width.
+        The band is widened to multiples of row_step, as required by the sensor, and clipped to the sensor.
+        Sub-array mode is switched on, or off if the band is the whole sensor.
+        Takes effect at the next startAcquisition().
+        Returns the actual (v_pos, v_size).
+        """
+        sensor_height = self.max_height[0]
+        v_end = min(sensor_height, int(numpy.ceil((v_pos + v_size) / row_step)) * row_step)
+        v_pos = max(0, int(v_pos) // row_step * row_step)
+        v_size = v_end - v_pos
+        # vpos and vsize are used by the camera only in sub-array mode
+        self.setPropertyValue("subarray_mode", "ON")
+        # shrink before moving, so that the band stays within the sensor at every step
+        if v_size < self.getPropertyValue("subarray_vsize")[0]:
+            self.setPropertyValue("subarray_vsize", v_size)
+            self.setPropertyValue("subarray_vpos", v_pos)
+        else:
+            self.setPropertyValue("subarray_vpos", v_pos)
+            self.setPropertyValue("subarray_vsize", v_size)
+        if v_size == sensor_height and self.getPropertyValue("subarray_hsize")[0] == self.max_width[0]:
+            self.setPropertyValue("subarray_mode", "OFF")
+        return v_pos, v_size
+
     def setACQMode(self, mode, number_frames = None):
         '''
         Set the acquisition mode to either run until aborted or to
         stop after acquiring a set number of frames.
         mode should be either "fixed_length" or "run_till_abort"
         if mode is "fixed_length", then number_frames indicates the number
-        of frames to acquire.
+        of frames to acquire. If mode is "run_till_abort", number_frames sets
+        the size of the ring buffer (10 seconds of frames by default).
         '''
 
         if self.acquisition_mode is "fixed_length" or \
@@ -740,7 +798,10 @@ class HamamatsuCamera(object):
         # number of frames for a fixed length acquisition
         #
         if self.acquisition_mode is "run_till_abort":
-            n_buffers = int(10 * self.getPropertyValue("internal_frame_rate")[0])
+            if self.number_frames:
+                n_buffers = self.number_frames
+            else:
+                n_buffers = int(10 * self.getPropertyValue("internal_frame_rate")[0])
         elif self.acquisition_mode is "fixed_length":
             n_buffers = self.number_frames
         self.number_image_buffers = n_buffers
@@ -0,0 +1,151 @@
+"""
+Deformable mirror influence calibration: poke each actuator, record the response of the bead images and metric,
+and store the result per mirror serial, so that optimizers can reuse it across samples.
+by @nvladimus, 2020
+"""
+import os
+import re
+import time
+import numpy as np
+
+FILE_PATTERN = re.compile(r"influence_(?P<serial>.+)_v(?P<version>\d+)\.npz$")
+
+
+class InfluenceCalibration:
+    """
+    Linear response of the bead ROIs to each actuator, around the base command:
+        image_matrix, (n_pixels, n_actuators), d(ROI pixels)/d(command), ROIs of all views concatenated,
+            normalized to ROI maximum of the base image;
+        metric_gradient, (n_actuators,), d(metric)/d(command);
+        metric_curvature, (n_actuators,), d2(metric)/d(command)2.
+    """
+    def __init__(self, image_matrix, metric_gradient, metric_curvature, base_command, amplitude, serial,
+                 roi_shape, timestamp=None, version=None):
+        self.image_matrix = np.asarray(image_matrix, dtype=np.float32)
+        self.metric_gradient = np.asarray(metric_gradient)
+        self.metric_curvature = np.asarray(metric_curvature)
+        self.base_command = np.asarray(base_command)
+        self.amplitude = amplitude
+        self.serial = str(serial)
+        self.roi_shape = tuple(roi_shape)
+        self.timestamp = timestamp if timestamp is not None else time.strftime("%Y-%m-%d %H:%M:%S")
+        self.version = version
+
+    @property
+    def n_actuators(self):
+        return self.image_matrix.shape[1]
+
+    def modes(self, n_modes=None, rel_threshold=0.1):
+        """
+        Mirror modes ordered by their effect on the bead images: right singular vectors of image_matrix.
+        Modes with singular value below rel_threshold of the largest one (invisible, e.g. piston, or noise) are dropped.
+        Use as basis of optimizers.ModalQuadratic or CMAES.
+        Returns
+            (n_modes, n_actuators) array, each mode scaled to max |command| = 1, as optimizers.zernike_basis().
+        """
+        _, s, vt = np.linalg.svd(self.image_matrix.astype(np.float64), full_matrices=False)
+        vt = vt[s > rel_threshold * s[0]][:n_modes]
+        return vt / np.abs(vt).max(axis=1, keepdims=True)
+
+    def perturbation_scale(self, min_scale=0.25, max_scale=4.0):
+        """
+        Per-actuator scale of SPGD perturbations, inversely proportional to the square root of the metric curvature,
+        normalized to mean 1: insensitive actuators get larger steps. Pass delta_cmd * scale as delta_cmd.
+        """
+        curvature = np.maximum(self.metric_curvature, 1e-3 * np.abs(self.metric_curvature).max() + 1e-12)
+        scale = 1.0 / np.sqrt(curvature)
+        scale /= scale.mean()
+        return np.clip(scale, min_scale, max_scale)
+
+    def newton_step(self, max_step=None):
+        """
+        Initial command step -gradient/curvature per actuator (diagonal Newton), for actuators with positive curvature.
+        Clipped to +/- max_step (default: calibration amplitude).
+        """
+        max_step = self.amplitude if max_step is None else max_step
+        step = np.zeros(self.n_actuators)
+        ok = self.metric_curvature > 0
+        step[ok] = - self.metric_gradient[ok] / self.metric_curvature[ok]
+        return np.clip(step, -max_step, max_step)
+
+    def save(self, calibration_dir):
+        """Save as the next version for this mirror serial. Returns the file path."""
+        os.makedirs(calibration_dir, exist_ok=True)
+        versions = list_versions(calibration_dir, self.serial)
+        self.version = (max(versions) + 1) if len(versions) > 0 else 1
+        path = calibration_path(calibration_dir, self.serial, self.version)
+        np.savez_compressed(path, image_matrix=self.image_matrix, metric_gradient=self.metric_gradient,
+                            metric_curvature=self.metric_curvature, base_command=self.base_command,
+                            amplitude=self.amplitude, serial=self.serial, roi_shape=self.roi_shape,
+                            timestamp=self.timestamp)
+        return path
+
+
+def calibration_path(calibration_dir, serial, version):
+    serial = "".join([c if c.isalnum() else "_" for c in str(serial)])
+    return os.path.join(calibration_dir, f"influence_{serial}_v{version:03d}.npz")
+
+
+def list_versions(calibration_dir, serial):
+    """Saved calibration versions of the mirror serial, sorted."""
+    if not os.path.isdir(calibration_dir):
+        return []
+    serial = "".join([c if c.isalnum() else "_" for c in str(serial)])
+    versions = []
+    for file_name in os.listdir(calibration_dir):
+        match = FILE_PATTERN.match(file_name)
+        if match and match.group('serial') == serial:
+            versions.append(int(match.group('version')))
+    return sorted(versions)
+
+
+def load_calibration(calibration_dir, serial, version=None):
+    """Load calibration of the mirror serial, the latest version by default. Returns None if there is none."""
+    versions = list_versions(calibration_dir, serial)
+    if len(versions) == 0:
+        return None
+    version = versions[-1] if version is None else version
+    with np.load(calibration_path(calibration_dir, serial, version)) as data:
+        return InfluenceCalibration(data['image_matrix'], data['metric_gradient'], data['metric_curvature'],
+                                    data['base_command'], float(data['amplitude']), str(data['serial']),
+                                    data['roi_shape'], str(data['timestamp']), version)
+
+
+def calibrate(evaluate, base_command, amplitude=0.1, serial='unknown', actuators=None, n_repeats=1):
+    """
+    Poke actuators one by one (push-pull, +/- amplitude around base_command) and record the response.
+    Parameters:
+        :param evaluate: optimizers.Evaluator, e.g. with apply_command=DmController.apply_cmd.
+            Its log provides the ROIs and metrics of each snap. 2 * len(actuators) * n_repeats + 2 snaps are taken:
+            the base command before the pokes, and again after them, to leave the mirror at base_command.
+        :param base_command: array of actuator commands, e.g. flat or best known command.
+        :param amplitude: float, poke amplitude, command units.
+        :param serial: str, mirror serial number.
+        :param actuators: indices of actuators to poke, all by default. Others get zero response.
+        :param n_repeats: int, pokes averaged per actuator.
+    Returns
+        InfluenceCalibration
+    """
+    base_command = np.asarray(base_command, dtype=np.float64)
+    n_actuators = len(base_command)
+    actuators = range(n_actuators) if actuators is None else actuators
+    evaluate.keep_rois = True
+    metric_base = evaluate(base_command, track=True)
+    rois_base = evaluate.log['rois'][-1].astype(np.float64)
+    scale = 1.0 / rois_base.max()
+    image_matrix = np.zeros((rois_base.size, n_actuators))
+    metric_gradient, metric_curvature = np.zeros(n_actuators), np.zeros(n_actuators)
+    for i in actuators:
+        poke = np.zeros(n_actuators)
+        poke[i] = amplitude
+        for k in range(n_repeats):
+            metric_plus = evaluate(base_command + poke)
+            rois_plus = evaluate.log['rois'][-1].astype(np.float64)
+            metric_minus = evaluate(base_command - poke)
+            rois_minus = evaluate.log['rois'][-1].astype(np.float64)
+            image_matrix[:, i] += scale * (rois_plus - rois_minus).ravel() / (2 * amplitude * n_repeats)
+            metric_gradient[i] += (metric_plus - metric_minus) / (2 * amplitude * n_repeats)
+            metric_curvature[i] += (metric_plus + metric_minus - 2 * metric_base) / (amplitude ** 2 * n_repeats)
+    evaluate(base_command)
+    return InfluenceCalibration(image_matrix, metric_gradient, metric_curvature, base_command, amplitude, serial,
+                                rois_base.shape)
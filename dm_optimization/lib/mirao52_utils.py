@@ -145,6 +145,19 @@ def DM_voltage_to_map(v):
     M[2:6,7] = v[48:52]
     return M
     
+def actuator_positions():
+    """
+    (x, y) positions of the 52 actuators of Mirao52e in the pupil, in units of the pupil radius,
+    arranged as in DM_voltage_to_map() (8x8 grid without corners, pitch = 1/4 of the radius).
+    Returns:
+    output: (52, 2) ndarray of doubles.
+    """
+    import numpy as np
+    M = DM_voltage_to_map(np.arange(52))
+    rows, cols = np.nonzero(~np.isnan(M))
+    order = np.argsort(M[rows, cols])
+    return np.stack([(cols[order] - 3.5) / 4.0, (rows[order] - 3.5) / 4.0], axis=1)
+    
 def plotDM(cmd, title="", cmap = "jet", vmin=-0.25, vmax=0.25):
     """Plot deformable mirror (Mirao52e) commands arranged in 2D colormap, units: Volts"""
     import numpy as np
@@ -0,0 +1,353 @@
+"""
+Sensorless adaptive optimization of the DM command with a common interface:
+an Evaluator applies a command, snaps and returns the image metric (minimized), counting camera snaps,
+and optimizers registered in OPTIMIZERS search the command space through it.
+Implemented: 'SPGD' (random +/- perturbations, as in the notebooks), 'modal_3N' (quadratic fit per mode,
+over actuators, Zernike modes or any other basis), 'CMA-ES' (evolution strategy over modal coefficients).
+by @nvladimus, 2020
+"""
+import time
+import numpy as np
+import scipy.special
+import optimization
+import mirao52_utils
+import spgd
+
+OPTIMIZERS = {}
+
+
+def register_optimizer(name):
+    """Decorator adding an Optimizer subclass to OPTIMIZERS under name."""
+    def decorator(cls):
+        cls.name = name
+        OPTIMIZERS[name] = cls
+        return cls
+    return decorator
+
+
+def make_optimizer(name, **params):
+    if name not in OPTIMIZERS:
+        raise ValueError(f"Unknown optimizer {name}, available: {list(OPTIMIZERS)}")
+    return OPTIMIZERS[name](**params)
+
+
+class BudgetExhausted(Exception):
+    """Raised by Evaluator when the maximum number of snaps is reached."""
+
+
+class Evaluator:
+    """
+    Apply DM command, snap image, and compute the metric of bead ROIs, averaged over beads and views
+    (one bead per view, or many beads across the field, see optimization.find_beads_in_views()).
+    Logs every evaluation, keeps the best command, and raises BudgetExhausted after max_snaps snaps.
+    """
+    def __init__(self, apply_command, snap, metric_settings, roi_centers, simulation=None, settle_time_s=0.1,
+                 max_snaps=300, callback=None, roi_groups=None, aggregate='mean'):
+        """
+        :param apply_command: function(cmd), e.g. spgd.dll_command_applier()
+        :param snap: function(not_before) returning image, see camera_snap module.
+        :param metric_settings: named tuple, see optimization.get_metric()
+        :param roi_centers: [(x, y), ...] bead positions, px, one or more per view.
+        :param simulation: named tuple of simulation settings, see optimization.simulate_roi(), or None.
+        :param settle_time_s: float, DM settle time, see spgd.measure_settle_time().
+        :param max_snaps: int
+        :param callback: function(record) called after every snap, e.g. to stream the run to a run_log.RunLog.
+            record is a dictionary with keys command, metric (per ROI), objective (aggregated metric), tracked, time_s,
+            rois, roi_centers.
+            It may raise BudgetExhausted to stop the optimizer (e.g. when converged).
+        :param roi_groups: view index of each ROI, or None, see optimization.aggregate_metrics().
+        :param aggregate: 'mean' or 'median' over beads, see optimization.aggregate_metrics().
+        """
+        self.apply_command = apply_command
+        self.snap = snap
+        self.metric_settings = metric_settings
+        self.roi_centers = [tuple(c) for c in roi_centers]
+        self.simulation = simulation
+        self.tracker = optimization.make_tracker(metric_settings, self.roi_centers, simulation)
+        self.settle_time_s = settle_time_s
+        self.max_snaps = max_snaps
+        self.callback = callback
+        self.roi_groups = roi_groups
+        self.aggregate = aggregate
+        self.context = optimization.MetricContext(metric_settings)
+        self.n_snaps = 0
+        self.best_command = None
+        self.best_metric = np.inf
+        self.keep_rois = False  # log ROIs of every snap, e.g. for influence.calibrate()
+        self.log = {'command': [], 'metric': [], 'objective': [], 'tracked': [], 'time_s': [], 'rois': []}
+        self.t_start = time.perf_counter()
+
+    def __call__(self, cmd, track=False):
+        """
+        Metric of the command, averaged over beads and views.
+        :param track: bool, update the bead positions (use for the current command, not for perturbations).
+        """
+        if self.n_snaps >= self.max_snaps:
+            raise BudgetExhausted()
+        if not optimization.safe_voltage(cmd):
+            raise ValueError('Voltage is outside of safe range.')
+        if self.simulation is None or not self.simulation.on:
+            self.apply_command(cmd)
+        image = self.snap(time.perf_counter() + self.settle_time_s)
+        self.n_snaps += 1
+        if self.tracker is not None:
+            rois, roi_centers = self.tracker.get_rois(image, track, getattr(self.snap, 'row_offset', 0))
+        else:
+            rois, roi_centers = optimization.get_rois(image, self.roi_centers, self.metric_settings, self.simulation,
+                                                      getattr(self.snap, 'row_offset', 0))
+        if track:
+            self.roi_centers = roi_centers
+        metrics = optimization.get_metric_batch(rois, self.metric_settings, self.context)
+        metric = optimization.aggregate_metrics(metrics, self.roi_groups, self.aggregate)
+        self.log['command'].append(np.array(cmd))
+        self.log['metric'].append(metrics)
+        self.log['objective'].append(metric)
+        self.log['tracked'].append(track)
+        self.log['time_s'].append(time.perf_counter() - self.t_start)
+        if self.keep_rois:
+            self.log['rois'].append(rois)
+        if metric < self.best_metric:
+            self.best_metric, self.best_command = metric, np.array(cmd)
+        if self.callback is not None:
+            self.callback({'command': self.log['command'][-1], 'metric': metrics, 'objective': metric, 'tracked': track,
+                           'time_s': self.log['time_s'][-1], 'rois': rois, 'roi_centers': self.roi_centers})
+        return metric
+
+    @property
+    def snaps_left(self):
+        return self.max_snaps - self.n_snaps
+
+    def snaps_to_converge(self, tolerance=0.05):
+        """Number of snaps after which the best metric so far is within tolerance of the total improvement
+        from the final best metric."""
+        if self.n_snaps == 0:
+            return 0
+        best_so_far = np.minimum.accumulate(self.log['objective'])
+        threshold = best_so_far[-1] + tolerance * (best_so_far[0] - best_so_far[-1])
+        return int(np.argmax(best_so_far <= threshold)) + 1
+
+    def summary(self, tolerance=0.05):
+        metrics = self.log['objective']
+        return {'n_snaps': self.n_snaps,
+                'metric_initial': float(metrics[0]) if self.n_snaps > 0 else np.nan,
+                'metric_best': float(self.best_metric),
+                'snaps_to_converge': self.snaps_to_converge(tolerance),
+                'time_s': self.log['time_s'][-1] if self.n_snaps > 0 else 0.0}
+
+
+class Optimizer:
+    """Base class. Subclasses implement _run(evaluate, cmd), calling evaluate(cmd) until the snap budget ends."""
+    name = None
+
+    def run(self, evaluate, cmd_ini):
+        """Optimize starting from cmd_ini. Returns the best command evaluated."""
+        try:
+            self._run(evaluate, np.array(cmd_ini, dtype=np.float64))
+        except BudgetExhausted:
+            pass
+        return evaluate.best_command
+
+    def _run(self, evaluate, cmd):
+        raise NotImplementedError
+
+
+def voltage_excess(cmd):
+    """How far cmd is outside of the safe range of optimization.safe_voltage(), in volts (0 inside)."""
+    cmd = np.abs(cmd)
+    return np.clip(cmd - 1.0, 0, None).sum() + max(0.0, cmd.sum() - 25.0)
+
+
+def evaluate_if_safe(evaluate, cmd, track=False):
+    """evaluate(cmd), or +inf without a snap if cmd is outside of the safe voltage range.
+    Lets optimizers reject unsafe candidates, where the Evaluator would abort the run with ValueError."""
+    if not optimization.safe_voltage(cmd):
+        return np.inf
+    return evaluate(cmd, track=track)
+
+
+def zernike_noll(j, rho, theta):
+    """Zernike polynomial of Noll index j (1 = piston), normalized to unit RMS over the unit disk."""
+    n, j1 = 0, j - 1
+    while j1 > n:
+        n += 1
+        j1 -= n
+    m = (-1) ** j * ((n % 2) + 2 * int((j1 + ((n + 1) % 2)) / 2))
+    radial = np.zeros_like(rho)
+    for s in range((n - abs(m)) // 2 + 1):
+        radial += (-1) ** s * scipy.special.comb(n - s, s) * scipy.special.comb(n - 2 * s, (n - abs(m)) // 2 - s) \
+                  * rho ** (n - 2 * s)
+    if m == 0:
+        return np.sqrt(n + 1) * radial
+    angular = np.cos(m * theta) if m > 0 else np.sin(-m * theta)
+    return np.sqrt(2 * (n + 1)) * radial * angular
+
+
+def zernike_basis(noll_indices=range(5, 16), positions=None):
+    """
+    DM commands approximating Zernike modes, by sampling the polynomials at the actuator positions.
+    Parameters:
+        :param noll_indices: Noll indices of the modes. Default skips piston, tip, tilt and defocus,
+            which move the bead rather than change its shape.
+        :param positions: (n_actuators, 2) array of (x, y) in units of the pupil radius,
+            mirao52_utils.actuator_positions() by default.
+    Returns
+        (n_modes, n_actuators) array, each mode scaled to max |command| = 1.
+    """
+    if positions is None:
+        positions = mirao52_utils.actuator_positions()
+    rho, theta = np.hypot(positions[:, 0], positions[:, 1]), np.arctan2(positions[:, 1], positions[:, 0])
+    basis = np.array([zernike_noll(j, rho, theta) for j in noll_indices])
+    return basis / np.abs(basis).max(axis=1, keepdims=True)
+
+
+def actuator_basis(actuator_mask=None, n_actuators=52):
+    """One mode per optimized actuator, see optimization.generate_actuator_mask()."""
+    mask = optimization.generate_actuator_mask(actuator_mask)
+    if mask is None:
+        return np.eye(n_actuators)
+    return np.eye(n_actuators)[np.nonzero(mask)[0]]
+
+
+@register_optimizer('SPGD')
+class SPGD(Optimizer):
+    """Stochastic parallel gradient descent with random +/- perturbations of all actuators, 3 snaps per iteration.
+    The update rule is spgd.SPGDRule, shared with spgd.PipelinedSPGD (the version overlapping metric computation
+    with mirror settling), and the same as in wiggle_mirror_snap_rois_2views() and the notebook loop."""
+    def __init__(self, gain=0.05, delta_cmd=0.05, actuator_mask=None, regularization=None, regularization_rate=0.25,
+                 dynamic_gain=True):
+        """
+        :param delta_cmd: float, or per-actuator array, e.g. delta_cmd * InfluenceCalibration.perturbation_scale()
+            to precondition the gradient by the calibrated metric curvature.
+        """
+        self.rule_args = (gain, delta_cmd, actuator_mask, regularization, regularization_rate, dynamic_gain)
+
+    def _run(self, evaluate, cmd):
+        rule = spgd.SPGDRule(*self.rule_args)
+        rule.update_gain(evaluate(cmd, track=True))
+        while True:
+            cmd_minus, cmd_plus = rule.perturbations(cmd)
+            cmd = rule.update(cmd, cmd_minus, cmd_plus, evaluate(cmd_plus) - evaluate(cmd_minus))
+            rule.update_gain(evaluate(cmd, track=True))
+
+
+@register_optimizer('modal_3N')
+class ModalQuadratic(Optimizer):
+    """
+    Sensorless AO by quadratic fit: each mode is biased by -amplitude, 0, +amplitude,
+    and its coefficient is set to the vertex of the parabola through the three metrics (3 snaps per mode).
+    Biased commands outside of the safe voltage range are not applied, and the mode moves to the best safe one.
+    Modes are the rows of basis: actuator_basis() (zonal, default), zernike_basis(),
+    or DM influence modes from influence.InfluenceCalibration.modes().
+    """
+    def __init__(self, basis=None, amplitude=0.1, max_step=2.0, n_rounds=None):
+        """
+        :param basis: (n_modes, n_actuators) array, actuator_basis() by default.
+        :param amplitude: float, bias of each mode, command units.
+        :param max_step: float, max correction per mode, in units of amplitude.
+        :param n_rounds: int, passes over all modes, or None to continue until the snap budget ends.
+        """
+        self.basis = basis
+        self.amplitude = amplitude
+        self.max_step = max_step
+        self.n_rounds = n_rounds
+
+    def _run(self, evaluate, cmd):
+        basis = self.basis if self.basis is not None else actuator_basis(n_actuators=len(cmd))
+        a = self.amplitude
+        i_round = 0
+        while self.n_rounds is None or i_round < self.n_rounds:
+            for mode in basis:
+                metric_0 = evaluate(cmd, track=True)
+                metric_minus = evaluate_if_safe(evaluate, cmd - a * mode)
+                metric_plus = evaluate_if_safe(evaluate, cmd + a * mode)
+                best_step = a * [0, -1, 1][int(np.argmin([metric_0, metric_minus, metric_plus]))]
+                curvature = metric_plus + metric_minus - 2 * metric_0
+                if np.isfinite(curvature) and curvature > 0:
+                    step = 0.5 * a * (metric_minus - metric_plus) / curvature
+                    step = np.clip(step, -self.max_step * a, self.max_step * a)
+                    if not optimization.safe_voltage(cmd + step * mode):  # vertex outside of the safe range
+                        step = best_step
+                else:  # no minimum within reach, or a bias was unsafe: take the best of the three
+                    step = best_step
+                cmd = cmd + step * mode
+            i_round += 1
+        evaluate(cmd, track=True)
+
+
+@register_optimizer('CMA-ES')
+class CMAES(Optimizer):
+    """
+    Covariance matrix adaptation evolution strategy (Hansen 2016, arXiv:1604.00772) over modal coefficients,
+    one snap per candidate. Robust to noise and local bumps of the metric, at the cost of more snaps than 3N
+    for smooth metrics. Candidates outside of the safe voltage range are not applied; they are ranked
+    after all safe ones, by voltage_excess(), which steers the distribution back into the safe range.
+    """
+    def __init__(self, basis=None, sigma=0.05, population_size=None):
+        """
+        :param basis: (n_modes, n_actuators) array, zernike_basis() by default, or InfluenceCalibration.modes().
+        :param sigma: float, initial step size, command units per mode.
+        :param population_size: int, candidates per generation, 4 + 3 ln(n_modes) by default.
+        """
+        self.basis = basis
+        self.sigma = sigma
+        self.population_size = population_size
+
+    def _run(self, evaluate, cmd_ini):
+        basis = self.basis if self.basis is not None else zernike_basis()
+        n = basis.shape[0]
+        lam = self.population_size or 4 + int(3 * np.log(n))
+        mu = lam // 2
+        weights = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+        weights /= weights.sum()
+        mu_eff = 1.0 / np.sum(weights ** 2)
+        c_c = (4 + mu_eff / n) / (n + 4 + 2 * mu_eff / n)
+        c_s = (mu_eff + 2) / (n + mu_eff + 5)
+        c_1 = 2 / ((n + 1.3) ** 2 + mu_eff)
+        c_mu = min(1 - c_1, 2 * (mu_eff - 2 + 1 / mu_eff) / ((n + 2) ** 2 + mu_eff))
+        d_s = 1 + 2 * max(0, np.sqrt((mu_eff - 1) / (n + 1)) - 1) + c_s
+        chi_n = np.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+        mean, sigma = np.zeros(n), self.sigma
+        C, p_c, p_s = np.eye(n), np.zeros(n), np.zeros(n)
+        evaluate(cmd_ini, track=True)
+        i_generation = 0
+        while True:
+            eigenvalues, B = np.linalg.eigh(C)
+            D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+            z = np.random.randn(lam, n)
+            y = (z * D) @ B.T
+            x = mean + sigma * y
+            candidates = cmd_ini + x @ basis
+            fitness = np.array([evaluate_if_safe(evaluate, candidate) for candidate in candidates])
+            excess = np.array([voltage_excess(candidate) for candidate in candidates])
+            order = np.lexsort((excess, fitness))[:mu]
+            y_w = weights @ y[order]
+            mean = mean + sigma * y_w
+            C_inv_sqrt_y_w = B @ ((B.T @ y_w) / D)
+            p_s = (1 - c_s) * p_s + np.sqrt(c_s * (2 - c_s) * mu_eff) * C_inv_sqrt_y_w
+            i_generation += 1
+            h_s = np.linalg.norm(p_s) / np.sqrt(1 - (1 - c_s) ** (2 * i_generation)) < (1.4 + 2 / (n + 1)) * chi_n
+            p_c = (1 - c_c) * p_c + h_s * np.sqrt(c_c * (2 - c_c) * mu_eff) * y_w
+            C = (1 - c_1 - c_mu) * C + c_1 * (np.outer(p_c, p_c) + (1 - h_s) * c_c * (2 - c_c) * C) \
+                + c_mu * (y[order].T * weights) @ y[order]
+            sigma *= np.exp((c_s / d_s) * (np.linalg.norm(p_s) / chi_n - 1))
+            evaluate_if_safe(evaluate, cmd_ini + mean @ basis, track=True)
+
+
+def compare_optimizers(make_evaluator, cmd_ini, optimizers, tolerance=0.05):
+    """
+    Run each optimizer from cmd_ini with a fresh evaluator, and report snaps needed to converge.
+    Parameters:
+        :param make_evaluator: function() returning a new Evaluator
+        :param cmd_ini: initial command
+        :param optimizers: dictionary {label: Optimizer}
+        :param tolerance: float, see Evaluator.snaps_to_converge()
+    Returns
+        dictionary {label: (best command, Evaluator.summary(), Evaluator)}
+    """
+    results = {}
+    for label, optimizer in optimizers.items():
+        evaluate = make_evaluator()
+        cmd_best = optimizer.run(evaluate, cmd_ini)
+        results[label] = (cmd_best, evaluate.summary(tolerance), evaluate)
+        print(f"{label}: {results[label][1]}")
+    return results
@@ -0,0 +1,114 @@
+"""
+HDF5 log of a DM optimization run, appended after every snap, so that the run survives crashes and can be resumed.
+Replaces the ad-hoc .npy files of the notebooks (metric_array, FWHM_xy_array, DMcmd_run, ROI stacks).
+One row per snap in each dataset:
+    command (n_actuators,), metric (n_rois,), objective (metric aggregated over ROIs), fwhm_xy (n_rois, 2) px,
+    tracked (bool), time_s (since session start), session (int, incremented on every resume),
+    roi_centers (n_rois, 2) px, rois (n_rois, h, w). ROIs are one per view, or many beads per view.
+Run settings are stored as JSON in the file attribute 'settings'.
+Datasets added in later versions (e.g. objective) are created on the first append to an older log,
+with the earlier rows filled with NaN (False, 0 for bool and int), so that all datasets keep n_records rows.
+by @nvladimus, 2020
+"""
+import json
+import numpy as np
+import h5py
+import optimization
+
+
+class RunLog:
+    """Appendable HDF5 run log, see module docstring."""
+    def __init__(self, path, settings=None):
+        """
+        :param path: str, HDF5 file, created if it does not exist, otherwise opened for appending (resume).
+        :param settings: dictionary of run settings (JSON-serializable), saved in a new file.
+            For an existing file, the saved settings are kept and returned by self.settings.
+        """
+        self.path = path
+        self.file = h5py.File(path, 'a')
+        if 'settings' not in self.file.attrs:
+            self.file.attrs['settings'] = json.dumps(settings if settings is not None else {})
+        self.session = int(self.file['session'][-1]) + 1 if self.n_records > 0 else 0
+
+    @property
+    def settings(self):
+        return json.loads(self.file.attrs['settings'])
+
+    def update_settings(self, settings):
+        """Replace saved settings, e.g. a larger snap budget of a resumed run."""
+        self.file.attrs['settings'] = json.dumps(settings)
+
+    @property
+    def n_records(self):
+        return self.file['metric'].shape[0] if 'metric' in self.file else 0
+
+    def append(self, record, fwhm_method='moments'):
+        """
+        Append one snap, and flush to disk.
+        :param record: dictionary with keys command, metric, objective, tracked, time_s, rois, roi_centers,
+            see optimizers.Evaluator callback.
+        :param fwhm_method: str, see optimization.get_FWHM_moments()
+        """
+        rois = np.asarray(record['rois'])
+        _, _, sigma_x, sigma_y = optimization.get_FWHM_moments(optimization.normalize_rois(rois.astype(np.float64)),
+                                                                method=fwhm_method)
+        row = {'command': np.asarray(record['command'], dtype=np.float64),
+               'metric': np.asarray(record['metric'], dtype=np.float64),
+               'objective': np.float64(record['objective']),
+               'fwhm_xy': np.stack([optimization.sigma2fwhm(sigma_x), optimization.sigma2fwhm(sigma_y)], axis=1),
+               'tracked': np.bool_(record['tracked']),
+               'time_s': np.float64(record['time_s']),
+               'session': np.int32(self.session),
+               'roi_centers': np.asarray(record['roi_centers'], dtype=np.float64),
+               'rois': rois}
+        n = self.n_records
+        for name, value in row.items():
+            value = np.asarray(value)
+            if name not in self.file:
+                compression = 'lzf' if name == 'rois' else None
+                fill = np.nan if np.issubdtype(value.dtype, np.floating) else 0
+                self.file.create_dataset(name, shape=(0,) + value.shape, maxshape=(None,) + value.shape,
+                                         dtype=value.dtype, chunks=(1,) + value.shape, compression=compression,
+                                         fillvalue=fill)
+            # rows missing from older logs (or after a crash between datasets) are padded with the fill value
+            self.file[name].resize(n + 1, axis=0)
+            self.file[name][n] = value
+        self.file.flush()
+
+    def read(self, name):
+        """Whole dataset as array, e.g. read('metric')."""
+        return self.file[name][()]
+
+    def last_tracked(self):
+        """Index of the last snap of an accepted (tracked) command, where a resumed run continues; None if no snaps."""
+        if self.n_records == 0:
+            return None
+        tracked = np.nonzero(self.read('tracked'))[0]
+        return int(tracked[-1]) if len(tracked) > 0 else 0
+
+    def objective(self):
+        """Objective of every snap. Where it is missing (NaN, e.g. logs written before it was added),
+        the mean metric over ROIs is used, which is the objective of aggregate='mean'."""
+        metric_mean = self.read('metric').reshape(self.n_records, -1).mean(axis=1)
+        if 'objective' not in self.file:
+            return metric_mean
+        objective = self.read('objective')[:self.n_records]
+        objective = np.concatenate([objective, np.full(self.n_records - len(objective), np.nan)])
+        return np.where(np.isnan(objective), metric_mean, objective)
+
+    def best(self):
+        """(command, objective) of the best snap logged, ignoring snaps without a valid metric."""
+        objective = self.objective()
+        if np.all(np.isnan(objective)):
+            raise ValueError("No valid metric in the run log")
+        i_best = int(np.nanargmin(objective))
+        return self.file['command'][i_best], float(objective[i_best])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
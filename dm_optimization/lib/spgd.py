@@ -0,0 +1,237 @@
+"""
+Pipelined Stochastic Parallel Gradient Descent (SPGD) of the deformable mirror shape, two views.
+Metrics of each snapped image are computed in a worker thread while the mirror settles for the next command,
+and the mirror settle time is measured instead of hard-coded.
+by @nvladimus, 2020
+"""
+import time
+import ctypes as ct
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import optimization
+
+
+def dll_command_applier(defmirror):
+    """Return apply_command(cmd) function for the Mirao52e DLL handle, as used in the notebooks."""
+    dm_trigger = ct.c_int32(0)
+    dm_status = ct.c_int32()
+
+    def apply_command(cmd):
+        cmd = np.ascontiguousarray(cmd, dtype=np.float64)
+        defmirror.mro_applySmoothCommand(cmd.ctypes.data_as(ct.POINTER(ct.c_float)), dm_trigger,
+                                         ct.byref(dm_status))
+    return apply_command
+
+
+def measure_settle_time(apply_command, snap, get_roi_stack, cmd_from, cmd_to, duration_s=0.3, tolerance=0.1):
+    """
+    Measure how long the mirror takes to settle after a command change, from a series of snaps.
+    The mirror is set to cmd_from and left to settle for duration_s, then set to cmd_to at t0,
+    and ROIs are snapped as fast as possible for duration_s. Settle time is the time of the first snap
+    after which the ROIs stay within tolerance of the final ROIs, relative to the total change.
+    Parameters:
+        :param apply_command: function(cmd)
+        :param snap: function(not_before) returning full image
+        :param get_roi_stack: function(image) returning array of ROIs
+        :param cmd_from: array of actuator commands
+        :param cmd_to: array of actuator commands, should change the PSF visibly (e.g. +/- a few delta_cmd)
+        :param duration_s: float
+        :param tolerance: float
+    Returns
+        settle time, s. Limited from below by the snap time, so it is an upper estimate.
+    """
+    apply_command(cmd_from)
+    rois_start = get_roi_stack(snap(time.perf_counter() + duration_s)).astype(np.float64)
+    t0 = time.perf_counter()
+    apply_command(cmd_to)
+    times, rois = [], []
+    while time.perf_counter() - t0 < duration_s:
+        rois.append(get_roi_stack(snap()).astype(np.float64))
+        times.append(time.perf_counter() - t0)
+    rois_final = rois[-1]
+    total_change = np.linalg.norm(rois_start - rois_final)
+    settled = [np.linalg.norm(r - rois_final) <= tolerance * total_change for r in rois]
+    i_settled = len(settled) - 1
+    while i_settled > 0 and settled[i_settled - 1]:
+        i_settled -= 1
+    return times[i_settled]
+
+
+class SPGDRule:
+    """
+    SPGD update rule, shared by PipelinedSPGD and optimizers.SPGD: random +/- perturbations of the optimized
+    actuators, command update by the metric difference, regularization, and the dynamic gain.
+    """
+    def __init__(self, gain_ini, delta_cmd, actuator_mask=None, regularization=None, regularization_rate=0.25,
+                 dynamic_gain=True, gain=None):
+        """
+        :param gain_ini: float, gain at the initial metric.
+        :param delta_cmd: float, or per-actuator array of perturbations.
+        :param actuator_mask: see optimization.generate_actuator_mask()
+        :param regularization: see optimization.regularize_command()
+        :param regularization_rate: float
+        :param dynamic_gain: bool, gain grows in inverse proportion to the (decreasing) metric.
+        :param gain: float, gain until the first metric is known, gain_ini by default.
+        """
+        self.gain_ini = gain_ini
+        self.gain = gain if gain is not None else gain_ini
+        self.delta_cmd = delta_cmd
+        self.dm_mask = optimization.generate_actuator_mask(actuator_mask)
+        self.regularization = regularization
+        self.regularization_rate = regularization_rate
+        self.dynamic_gain = dynamic_gain
+        self.metric_ini = None
+
+    def perturbations(self, cmd):
+        """(cmd_minus, cmd_plus) with random signs per actuator."""
+        return optimization.generate_incremented_commands(cmd, self.delta_cmd, self.dm_mask)
+
+    def update(self, cmd, cmd_minus, cmd_plus, delta_metric):
+        """New command from the metric difference delta_metric = metric(cmd_plus) - metric(cmd_minus)."""
+        delta_cmd_array = cmd_plus - cmd_minus
+        # apply increment only to non-zero deltas (if actuators subset is optimized)
+        non_zero_ind = np.where(abs(delta_cmd_array) > 1e-6)
+        increment_cmd = np.zeros(len(cmd))
+        increment_cmd[non_zero_ind] = - self.gain * delta_metric * delta_cmd_array[non_zero_ind]
+        return optimization.regularize_command(cmd + increment_cmd, self.regularization, self.regularization_rate)
+
+    def update_gain(self, metric):
+        """Update the gain from the metric of the current command, the first call sets the initial metric."""
+        if self.metric_ini is None:
+            self.metric_ini = metric
+        if self.dynamic_gain:  # gain increases as the cost function decreases
+            self.gain = self.gain_ini * self.metric_ini / metric
+
+
+class PipelinedSPGD:
+    """
+    SPGD optimization of DM command, with the bead imaged in two views (left and right).
+    Each iteration applies plus and minus perturbations of the current command, snaps both,
+    updates the command by the metric difference, then applies and snaps the updated command.
+    Metric computation (ROI crops, tracking, get_metric_batch) of every snap is queued to a single worker thread,
+    so it runs while the mirror settles for the next command. Only the gradient update waits for the results.
+    """
+    def __init__(self, apply_command, snap, metric_settings, run_settings, roi_centers, simulation=None,
+                 settle_time_s=0.1, dynamic_gain=True):
+        """
+        :param apply_command: function(cmd), e.g. from dll_command_applier()
+        :param snap: function(not_before) returning image, e.g. camera_snap.sleeping_snapper() or SubarraySnapper.
+            If snap has attribute row_offset, images are sensor rows starting from row_offset.
+        :param metric_settings: named tuple, see optimization.get_metric()
+        :param run_settings: named tuple with fields gain_ini, gain, delta_cmd, regularization, regularization_rate,
+            n_iterations, actuator_mask, as in the notebook.
+        :param roi_centers: ((x, y) left view, (x, y) right view) bead positions, px.
+        :param simulation: named tuple of simulation settings, see optimization.simulate_roi(), or None.
+        :param settle_time_s: float, DM settle time, e.g. from measure_settle() method.
+        :param dynamic_gain: bool, gain grows in inverse proportion to the (decreasing) metric.
+        """
+        self.apply_command = apply_command
+        self.snap = snap
+        self.metric_settings = metric_settings
+        self.run_settings = run_settings
+        self.roi_centers = [tuple(c) for c in roi_centers]
+        self.simulation = simulation
+        self.tracker = optimization.make_tracker(metric_settings, self.roi_centers, simulation)
+        self.settle_time_s = settle_time_s
+        self.dynamic_gain = dynamic_gain
+        self.context = optimization.MetricContext(metric_settings)
+        self.dm_mask = optimization.generate_actuator_mask(run_settings.actuator_mask)
+        self.rule = None
+        self.executor = ThreadPoolExecutor(max_workers=1)  # single worker keeps jobs in order
+        self.history = None
+
+    def get_roi_stack(self, image, track=False):
+        """Crop ROIs of both views. If track, update the ROI centers (only from the worker thread)."""
+        if self.tracker is not None:
+            rois, roi_centers = self.tracker.get_rois(image, track, getattr(self.snap, 'row_offset', 0))
+        else:
+            rois, roi_centers = optimization.get_rois(image, self.roi_centers, self.metric_settings, self.simulation,
+                                                      getattr(self.snap, 'row_offset', 0))
+        if track:
+            self.roi_centers = roi_centers
+        return rois
+
+    def _measure(self, image, track=False):
+        rois = self.get_roi_stack(image, track)
+        return rois, optimization.get_metric_batch(rois, self.metric_settings, self.context), list(self.roi_centers)
+
+    def _apply_and_snap(self, cmd):
+        """Check and apply command, then snap the image after the settle time."""
+        if not optimization.safe_voltage(cmd):
+            raise ValueError('Voltage is outside of safe range.')
+        if self.simulation is None or not self.simulation.on:
+            self.apply_command(cmd)
+        return self.snap(time.perf_counter() + self.settle_time_s)
+
+    def measure_settle(self, current_cmd, n_steps=3, **kwargs):
+        """Measure DM settle time with a perturbation of n_steps * delta_cmd, see measure_settle_time()."""
+        delta_cmd_minus, delta_cmd_plus = optimization.generate_incremented_commands(
+            current_cmd, n_steps * self.run_settings.delta_cmd, self.dm_mask)
+        self.settle_time_s = measure_settle_time(self.apply_command, self.snap, self.get_roi_stack,
+                                                 delta_cmd_minus, delta_cmd_plus, **kwargs)
+        self.apply_command(current_cmd)
+        return self.settle_time_s
+
+    def run(self, current_cmd, n_iterations=None, callback=None):
+        """
+        Run SPGD iterations starting from current_cmd.
+        :param callback: function(iteration, history) called after each iteration, or None.
+        Returns
+            dictionary of arrays: 'commands' (n, n_actuators), 'metric' (n, 2 views),
+            'metric_plus_minus' (n, 2 views, 2), 'rois' (n, 2 views, h, w), 'rois_plus_minus' (n, 2 views, 2, h, w),
+            'roi_centers' (n, 2 views, 2), 'gain' (n,), 'iteration_time_s' (n,), and 'settle_time_s'.
+        """
+        n_iterations = n_iterations if n_iterations is not None else self.run_settings.n_iterations
+        run_settings = self.run_settings
+        self.rule = rule = SPGDRule(run_settings.gain_ini, run_settings.delta_cmd, run_settings.actuator_mask,
+                                    run_settings.regularization, run_settings.regularization_rate, self.dynamic_gain,
+                                    gain=run_settings.gain)
+        h, w = self.metric_settings.roi_size[1], self.metric_settings.roi_size[0]
+        n_actuators = len(current_cmd)
+        self.history = history = {'commands': np.zeros((n_iterations, n_actuators)),
+                                  'metric': np.zeros((n_iterations, 2)),
+                                  'metric_plus_minus': np.zeros((n_iterations, 2, 2)),
+                                  'rois': np.zeros((n_iterations, 2, h, w)),
+                                  'rois_plus_minus': np.zeros((n_iterations, 2, 2, h, w)),
+                                  'roi_centers': np.zeros((n_iterations, 2, 2)),
+                                  'gain': np.zeros(n_iterations),
+                                  'iteration_time_s': np.zeros(n_iterations),
+                                  'settle_time_s': self.settle_time_s}
+        future_current = None  # metric of the command after the previous update, still being computed
+        t_start = time.perf_counter()
+        for it in range(n_iterations):
+            delta_cmd_minus, delta_cmd_plus = rule.perturbations(current_cmd)
+            image = self._apply_and_snap(delta_cmd_plus)
+            future_plus = self.executor.submit(self._measure, image)
+            image = self._apply_and_snap(delta_cmd_minus)  # plus metric is computed meanwhile
+            future_minus = self.executor.submit(self._measure, image)
+            if future_current is not None:
+                self._record_current(it - 1, future_current.result())
+                rule.update_gain(history['metric'][it - 1].mean())
+            rois_plus, m_plus, _ = future_plus.result()
+            rois_minus, m_minus, _ = future_minus.result()
+            current_cmd = rule.update(current_cmd, delta_cmd_minus, delta_cmd_plus, (m_plus - m_minus).mean())
+            image = self._apply_and_snap(current_cmd)
+            future_current = self.executor.submit(self._measure, image, True)  # with bead tracking
+            history['commands'][it] = current_cmd
+            history['metric_plus_minus'][it] = np.stack([m_plus, m_minus], axis=1)
+            history['rois_plus_minus'][it] = np.stack([rois_plus, rois_minus], axis=1)
+            history['gain'][it] = rule.gain
+            history['iteration_time_s'][it] = time.perf_counter() - t_start
+            if callback is not None and it > 0:
+                callback(it - 1, history)
+        if future_current is not None:
+            self._record_current(n_iterations - 1, future_current.result())
+            if callback is not None:
+                callback(n_iterations - 1, history)
+        self.run_settings = run_settings._replace(gain=rule.gain)
+        return history
+
+    def _record_current(self, it, measurement):
+        rois, metric, roi_centers = measurement
+        self.history['rois'][it] = rois
+        self.history['metric'][it] = metric
+        self.history['roi_centers'][it] = roi_centers
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,309 @@
+"""
+Headless DM optimization runner, a command-line version of the notebook loop.
+Every snap (command, metrics, FWHMs, ROI crops) is appended to an HDF5 run log (lib/run_log.py),
+so the run does not depend on a notebook kernel, and can be resumed after a crash or Ctrl-C:
+    python optimize_dm.py run1.h5 --roi 512 1050 --roi 1536 1050 --optimizer SPGD --param gain=0.035 --max-snaps 300
+    python optimize_dm.py run1.h5 --resume
+With --influence-dir, the influence calibration of the mirror (lib/influence.py) gives the modal_3N/CMA-ES basis,
+the per-actuator SPGD perturbations, and a diagonal Newton step from the initial command.
+A resumed run restarts the optimizer from the last accepted command, with the bead positions tracked so far
+and the remaining snap budget. Optimizer-internal state (e.g. SPGD dynamic gain reference, CMA-ES distribution)
+is re-initialized.
+Run from the dm_optimization folder.
+by @nvladimus, 2020
+"""
+import sys
+sys.path.append('./lib')
+import argparse
+import collections
+import ctypes as ct
+import inspect
+import json
+import time
+import numpy as np
+import optimization
+import optimizers
+import camera_snap
+import spgd
+import run_log
+import dm_simulator
+import influence
+from mirao52_utils import read_Mirao_commandFile, errors
+
+Metric = collections.namedtuple('Metric', ['method1', 'method2', 'weights_method12', 'weights_fwhm_xy',
+                                           'r2_integration_radius', 'normalize_brightness', 'roi_size',
+                                           'tracking', 'peak_estimate', 'ideal_PSF'])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sensorless DM optimization on beads, logged to HDF5.")
+    parser.add_argument('log', help="HDF5 run log, created or resumed")
+    parser.add_argument('--resume', action='store_true', help="continue the run in log, with its saved settings")
+    parser.add_argument('--optimizer', default='SPGD', choices=list(optimizers.OPTIMIZERS))
+    parser.add_argument('--param', action='append', default=[], metavar='KEY=VALUE',
+                        help="optimizer parameter, value in JSON, e.g. gain=0.035 or actuator_mask='\"outer_ring\"'")
+    parser.add_argument('--max-snaps', type=int, default=None,
+                        help="snap budget of the whole run, 300 by default. With --resume, extends the saved budget")
+    parser.add_argument('--roi', type=float, nargs=2, action='append', metavar=('X', 'Y'),
+                        help="approximate bead position in each view, px")
+    parser.add_argument('--detect-beads', type=int, default=0, metavar='N',
+                        help="instead of --roi, detect up to N beads in each view (left and right image half), "
+                             "and optimize their field-averaged metric")
+    parser.add_argument('--min-separation', type=int, default=60, help="min distance between detected beads, px")
+    parser.add_argument('--threshold-sigmas', type=float, default=5.0, help="bead detection threshold")
+    parser.add_argument('--min-snr', type=float, default=20.0,
+                        help="minimum integrated signal-to-noise ratio of a detected bead")
+    parser.add_argument('--aggregate', default='mean', choices=['mean', 'median'], help="averaging over beads")
+    parser.add_argument('--roi-size', type=int, default=100)
+    parser.add_argument('--metric', default='R2Integral', choices=list(optimization.METRICS))
+    parser.add_argument('--ideal-psf', default=None,
+                        help=".npy image of the ideal PSF, ROI-sized, required by --metric MSE_simulated")
+    parser.add_argument('--r2-radius', type=float, default=None, help="R2 integration radius, px (roi_size/2 - 10)")
+    parser.add_argument('--tracking', default='centroid', choices=['centroid', 'xcorr', 'mass', 'xy', 'none'],
+                        help="bead tracking, see optimization.BeadTracker ('centroid', 'xcorr') and get_roi()")
+    parser.add_argument('--cmd-ini', default=None, help=".npy or .mro command to start from (zeros by default)")
+    parser.add_argument('--exposure-ms', type=float, default=20.0)
+    parser.add_argument('--settle-s', type=float, default=0.1, help="DM settle time, see spgd.measure_settle_time()")
+    parser.add_argument('--dm-dll', default='./lib/mirao_x64/mirao52e.dll')
+    parser.add_argument('--influence-dir', default=None,
+                        help="folder of influence calibrations (lib/influence.py) to use, the latest of --serial")
+    parser.add_argument('--serial', default='unknown', help="mirror serial number of the influence calibration")
+    parser.add_argument('--simulation', action='store_true',
+                        help="simulated camera and DM (lib/dm_simulator.py), beads at the --roi positions")
+    parser.add_argument('--seed', type=int, default=0, help="aberration, mirror and noise seed of the simulation")
+    parser.add_argument('--report-every', type=int, default=1, help="print progress every N accepted commands")
+    parser.add_argument('--stop-window', type=int, default=0,
+                        help="stop when the best metric improved less than --stop-tolerance over this many snaps")
+    parser.add_argument('--stop-tolerance', type=float, default=0.005, help="relative improvement")
+    return parser.parse_args(argv)
+
+
+def make_metric_settings(settings):
+    roi_size = settings['roi_size']
+    r2_radius = settings['r2_radius'] if settings['r2_radius'] is not None else roi_size / 2 - 10
+    ideal_psf = np.load(settings['ideal_psf']) if settings.get('ideal_psf') is not None else None
+    if settings['metric'] == 'MSE_simulated':
+        if ideal_psf is None:
+            raise ValueError("--metric MSE_simulated requires --ideal-psf")
+        if ideal_psf.shape != (roi_size, roi_size):
+            raise ValueError(f"Ideal PSF shape {ideal_psf.shape} must match --roi-size {roi_size}")
+    return Metric(method1=settings['metric'], method2=None, weights_method12=(1, 0), weights_fwhm_xy=(0.5, 0.5),
+                  r2_integration_radius=r2_radius, normalize_brightness=True, roi_size=(roi_size, roi_size, 1),
+                  tracking=None if settings['tracking'] == 'none' else settings['tracking'], peak_estimate='max',
+                  ideal_PSF=ideal_psf)
+
+
+def parse_optimizer_params(params):
+    parsed = {}
+    for param in params:
+        key, value = param.split('=', 1)
+        parsed[key] = json.loads(value)
+    return parsed
+
+
+def load_influence(settings):
+    """Influence calibration of the mirror, or None without --influence-dir.
+    The version loaded is saved in settings, so that a resumed run uses the same calibration."""
+    if settings.get('influence_dir') is None:
+        return None
+    calibration = influence.load_calibration(settings['influence_dir'], settings['serial'],
+                                             settings.get('influence_version'))
+    if calibration is None:
+        raise ValueError(f"No influence calibration of mirror {settings['serial']} in {settings['influence_dir']}")
+    settings['influence_version'] = calibration.version
+    print(f"Influence calibration of mirror {calibration.serial}, version {calibration.version} "
+          f"({calibration.timestamp})")
+    return calibration
+
+
+def influence_optimizer_params(name, params, calibration):
+    """Optimizer parameters using the calibration: its modes as the basis of modal_3N and CMA-ES,
+    and SPGD perturbations scaled per actuator by the metric curvature. Explicit --param values are kept."""
+    params = dict(params)
+    if calibration is None:
+        return params
+    if name in ('modal_3N', 'CMA-ES') and 'basis' not in params:
+        params['basis'] = calibration.modes()
+    elif name == 'SPGD':
+        delta_cmd = params.get('delta_cmd', inspect.signature(optimizers.SPGD).parameters['delta_cmd'].default)
+        params['delta_cmd'] = np.asarray(delta_cmd) * calibration.perturbation_scale()
+    return params
+
+
+def load_command(path, dm_handle=None):
+    if path is None:
+        return np.zeros(52)
+    if path.lower().endswith('.mro'):
+        return read_Mirao_commandFile(path, dm_handle)
+    return np.load(path)
+
+
+class ProgressReporter:
+    """Evaluator callback: append every snap to the run log, print convergence of accepted commands,
+    and stop the optimizer (BudgetExhausted) if the best metric stopped improving."""
+    def __init__(self, log, n_snaps_done, max_snaps, report_every=1, stop_window=0, stop_tolerance=0.005):
+        self.log = log
+        self.n_snaps = n_snaps_done
+        self.max_snaps = max_snaps
+        self.report_every = report_every
+        self.stop_window = stop_window
+        self.stop_tolerance = stop_tolerance
+        self.n_tracked = 0
+        self.best_history = []
+        self.t_start = time.perf_counter()
+        self.n_snaps_start = n_snaps_done
+
+    def __call__(self, record):
+        self.log.append(record)
+        self.n_snaps += 1
+        metric = record['objective']
+        self.best_history.append(min(metric, self.best_history[-1]) if self.best_history else metric)
+        if record['tracked']:
+            self.n_tracked += 1
+            if self.n_tracked % self.report_every == 0:
+                fwhm = self.log.file['fwhm_xy'][-1].mean(axis=0)
+                rate = (self.n_snaps - self.n_snaps_start) / (time.perf_counter() - self.t_start)
+                print(f"snap {self.n_snaps}/{self.max_snaps}: metric {metric:.4f}, best {self.best_history[-1]:.4f}, "
+                      f"FWHM(x,y) {fwhm[0]:.2f}, {fwhm[1]:.2f} px, {rate:.1f} snaps/s", flush=True)
+        if 0 < self.stop_window < len(self.best_history):
+            best_before = self.best_history[-1 - self.stop_window]
+            if best_before - self.best_history[-1] < self.stop_tolerance * abs(best_before):
+                print(f"Converged: best metric improved less than {100 * self.stop_tolerance:.2g}% "
+                      f"over the last {self.stop_window} snaps.")
+                raise optimizers.BudgetExhausted()
+
+
+def detect_beads(apply_command, snap, cmd_ini, settings, metric_settings):
+    """Snap with the initial command and detect beads in the left and right image half.
+    Bead positions and their views are saved in settings ('roi', 'roi_groups')."""
+    apply_command(cmd_ini)
+    image = snap(time.perf_counter() + settings['settle_s'])
+    row_offset = getattr(snap, 'row_offset', 0)
+    h, w = image.shape
+    view_rois = [(0, row_offset, w // 2, h), (w // 2, row_offset, w - w // 2, h)]
+    roi_centers, views = optimization.find_beads_in_views(image, view_rois, settings['detect_beads'],
+                                                          settings['min_separation'], metric_settings.roi_size[:2],
+                                                          settings['threshold_sigmas'], row_offset,
+                                                          settings.get('min_snr', 20.0))
+    if len(roi_centers) == 0:
+        raise ValueError("No beads detected, lower --threshold-sigmas, --min-snr or give --roi positions.")
+    print(f"Detected {views.count(0)} beads in the left view, {views.count(1)} in the right view.")
+    settings['roi'] = [list(c) for c in roi_centers]
+    settings['roi_groups'] = views
+    return roi_centers
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.resume:
+        log = run_log.RunLog(args.log)
+        settings = log.settings
+        if args.max_snaps is not None:
+            settings['max_snaps'] = args.max_snaps
+            log.update_settings(settings)
+        if log.n_records == 0:
+            raise ValueError(f"Nothing to resume in {args.log}")
+        metric_settings = make_metric_settings(settings)
+        i_last = log.last_tracked()
+        cmd_ini = log.file['command'][i_last]
+        roi_centers = [tuple(c) for c in log.file['roi_centers'][i_last]]
+        print(f"Resuming {args.log} (session {log.session}) from snap {i_last + 1} of {log.n_records}, "
+              f"metric {log.objective()[i_last]:.4f}")
+    else:
+        if args.roi is None and args.detect_beads == 0:
+            raise ValueError("Bead positions (--roi X Y, for each view) or --detect-beads are required for a new run.")
+        settings = {key: value for key, value in vars(args).items() if key not in ('log', 'resume')}
+        settings['optimizer_params'] = parse_optimizer_params(args.param)
+        settings['max_snaps'] = args.max_snaps if args.max_snaps is not None else 300
+        settings['roi_groups'] = None  # views of the beads, set by detect_beads()
+        metric_settings = make_metric_settings(settings)  # check the metric before creating the log
+        log = run_log.RunLog(args.log, settings)
+        if log.n_records > 0:
+            raise ValueError(f"{args.log} already has {log.n_records} snaps, use --resume or a new file.")
+        roi_centers = [tuple(c) for c in settings['roi']] if settings['roi'] is not None else None
+        cmd_ini = None
+    calibration = load_influence(settings)
+    if calibration is not None:
+        log.update_settings(settings)
+    n_snaps_left = settings['max_snaps'] - log.n_records
+    if n_snaps_left <= 0:
+        print(f"Snap budget of {settings['max_snaps']} is used up, resume with a larger --max-snaps to continue.")
+        log.close()
+        return
+
+    dm_handle = cam_handle = snap = None
+    try:
+        if settings['simulation']:
+            mirror = dm_simulator.SimulatedMirror(seed=settings['seed'])
+            apply_command = mirror.apply_command
+            if settings['detect_beads'] == 0:
+                bead_positions = settings['roi']
+            else:  # detect_beads beads in each view, the left and right image half
+                h, w = 2048, 2048  # SimulatedCamera image_shape
+                bead_positions = [p for i_view, region in enumerate([(0, 0, w // 2, h), (w // 2, 0, w - w // 2, h)])
+                                  for p in dm_simulator.random_bead_positions(settings['detect_beads'],
+                                                                              seed=settings['seed'] + i_view,
+                                                                              region=region)]
+            snap = dm_simulator.SimulatedCamera(mirror, bead_positions, seed=settings['seed'])
+        else:
+            import hamamatsu_camera as cam
+            dm_handle = ct.windll.LoadLibrary(settings['dm_dll'])
+            dm_status = ct.c_int32()
+            assert dm_handle.mro_open(ct.byref(dm_status)), errors[dm_status.value]
+            apply_command = spgd.dll_command_applier(dm_handle)
+            param_init = cam.DCAMAPI_INIT(0, 0, 0, 0, None, None)
+            param_init.size = ct.sizeof(param_init)
+            if cam.dcam.dcamapi_init(ct.byref(param_init)) != cam.DCAMERR_NOERROR or param_init.iDeviceCount == 0:
+                raise cam.DCAMException("DCAM initialization failed, or no camera found.")
+            cam_handle = cam.HamamatsuCamera(camera_id=0)
+            cam_handle.setPropertyValue("exposure_time", settings['exposure_ms'] / 1000.)
+            if roi_centers is None:  # full frames to detect beads in
+                snap = camera_snap.StreamingSnapper(cam_handle)
+            else:
+                snap = camera_snap.SubarraySnapper(cam_handle, roi_centers, settings['roi_size'])
+            snap.start()
+        if cmd_ini is None:
+            cmd_ini = load_command(settings['cmd_ini'], dm_handle)
+            if calibration is not None:
+                cmd_newton = cmd_ini + calibration.newton_step()
+                if optimization.safe_voltage(cmd_newton):
+                    cmd_ini = cmd_newton
+                else:
+                    print("Newton step of the influence calibration is outside of the safe range, not applied.")
+        if roi_centers is None:
+            roi_centers = detect_beads(apply_command, snap, cmd_ini, settings, metric_settings)
+            log.update_settings(settings)
+            if cam_handle is not None:  # read out only the rows of the detected beads from now on
+                snap.stop()
+                snap = camera_snap.SubarraySnapper(cam_handle, roi_centers, settings['roi_size'])
+                snap.start()
+
+        reporter = ProgressReporter(log, log.n_records, settings['max_snaps'], args.report_every,
+                                    settings['stop_window'], settings['stop_tolerance'])
+        evaluate = optimizers.Evaluator(apply_command, snap, metric_settings, roi_centers, None,
+                                        settings['settle_s'], n_snaps_left, callback=reporter,
+                                        roi_groups=settings.get('roi_groups'), aggregate=settings.get('aggregate', 'mean'))
+        optimizer_params = influence_optimizer_params(settings['optimizer'], settings['optimizer_params'], calibration)
+        optimizer = optimizers.make_optimizer(settings['optimizer'], **optimizer_params)
+        print(f"{settings['optimizer']} {settings['optimizer_params']}, {n_snaps_left} snaps left")
+        optimizer.run(evaluate, cmd_ini)
+    except KeyboardInterrupt:
+        print("Interrupted, resume with --resume.")
+    finally:
+        if log.n_records > 0:
+            cmd_best, metric_best = log.best()
+            np.save(args.log.rsplit('.', 1)[0] + '_best_cmd.npy', cmd_best)
+            print(f"Best metric {metric_best:.4f} in {log.n_records} snaps, command saved next to the log.")
+            if dm_handle is not None:
+                apply_command(cmd_best)
+        log.close()
+        if cam_handle is not None:
+            if snap is not None:
+                snap.stop()
+            cam_handle.shutdown()
+        if dm_handle is not None:
+            dm_handle.mro_close(ct.byref(dm_status))
+
+
+if __name__ == '__main__':
+    main()
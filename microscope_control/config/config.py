@@ -15,7 +15,13 @@ scanning = {
 dm = {'diameter_mm': 15.0}
 
 saving = {
-    'root_folder': 'C:/Users/Nikita/Pictures'
+    'root_folder': ['C:/Users/Nikita/Pictures'],  # several folders on different disks: stacks are striped over them
+    'stripe_by': 'angle',  # 'angle', 'tile', or 'stack': how stacks are distributed over the root folders
+    'separate_process': True,  # write files in a separate process (needs Python >= 3.8), otherwise in a thread
+    'buffer_size_frames': 200,  # shared-memory ring buffer between grabbing and saving processes
+    'preflight_check': True,  # check free space and write speed of the disk(s) before acquisition
+    'preflight_margin': 1.2,  # required (disk speed / data rate) and (free space / data volume)
+    'preflight_test_mb': 200,  # size of the write speed test, per disk
 }
 
 microscope = {
@@ -23,3 +29,39 @@ microscope = {
     'FOV_x_um': 100,
 }
 
+
+# real-time PSF metrics of beads in the L and R view ROIs of the camera window
+psf_metrics = {
+    'lib_path': '../dm_optimization/lib',  # location of optimization.py
+    'update_interval_s': 0.5,
+    'n_beads_per_view': 3,
+    'min_separation_px': 30,
+    'threshold_sigmas': 5.0,  # bead detection threshold above background, in noise sigmas
+    'min_snr': 20.0,  # minimum integrated signal-to-noise ratio of a detected bead, rejects noise peaks
+    'crop_size_px': 40,  # square crop around each bead
+    'fwhm_method': 'moments',  # 'moments' or 'log_parabola' (fast), 'fit' (2D Gaussian least-squares)
+    # settings of optimization.get_metric(), see dm_optimization/lib/optimization.py
+    'method1': 'R2Integral',
+    'method2': None,
+    'weights_method12': (1, 0),
+    'weights_fwhm_xy': (0.5, 0.5),
+    'r2_integration_radius': 15,
+    'normalize_brightness': True,
+    'tracking': None,
+    'peak_estimate': 'center',
+}
+
+# library of optimized DM commands indexed by imaging conditions, see dm_optimization/lib/command_library.py
+dm_library = {
+    'file': './config/dm_command_library.json',
+    'mirror_serial': 'unknown',
+    # conditions not read from devices, set them for the current sample
+    'chamber': 'water',
+    'coverslip_tilt_deg': 0.0,
+    'wavelength_nm': 488,
+    'max_distance': 3.0,  # farthest conditions to reuse a command from, in units of condition scales
+    # apply commands interpolated from library entries at stage positions, per scan line, during acquisition
+    'correction_map_during_scan': False,
+    'scales': {'coverslip_tilt_deg': 1.0, 'wavelength_nm': 50.0, 'etl_current_mA': 10.0,
+               'stage_x_mm': 1.0, 'stage_y_mm': 1.0},
+}
@@ -5,6 +5,7 @@ import sys
 sys.path.append('./src')
 sys.path.append('./config')
 import config
+sys.path.append(config.psf_metrics['lib_path'])
 import os
 from PyQt5 import QtWidgets
 from PyQt5 import QtGui, QtCore
@@ -13,9 +14,17 @@ from PyQt5.uic import loadUi
 import pyqtgraph as pg
 import numpy as np
 import time
+import queue
+import multiprocessing as mp
 from collections import deque
 import hamamatsu_camera as cam
-import npy2bdv
+import stack_writer
+import preflight
+import image_display
+import psf_metrics
+import optimization
+import command_library
+import correction_map
 import lightsheet_generator as lsg
 import deformable_mirror_Mirao52e as def_mirror
 import etl_controller_Optotune as etl
@@ -36,6 +45,15 @@ class CameraWindow(QtWidgets.QWidget):
         self.cam_sensor_dims = self.cam_image_dims = parent.dev_cam.config['image_shape']
         self.image_display = pg.ImageView(self)
         self.roi_line_fwhm = self.roi_line_fwhm_data = self.roi_fwhm_text = None
+        self.roi_L = self.roi_R = None
+        self.scatter_beads = pg.ScatterPlotItem(symbol='o', size=12, pen=pg.mkPen((0, 200, 200)), brush=None)
+        self.text_beads = []
+        self.display_scale = 1  # camera pixels per displayed pixel
+        self.plot_histogram = pg.PlotWidget()
+        self.curve_histogram = self.plot_histogram.plot(pen=pg.mkPen((200, 200, 200)), fillLevel=0,
+                                                        brush=(100, 100, 100, 100))
+        self.lines_levels = [pg.InfiniteLine(angle=90, movable=False, pen=pg.mkPen((200, 200, 0))) for i in range(2)]
+        self.checkbox_auto_contrast = QtWidgets.QCheckBox('Auto contrast')
         self.button_cam_snap = QtWidgets.QPushButton('Snap')
         self.button_cam_live = QtWidgets.QPushButton('Live')
         self.combobox_fwhm = QtWidgets.QComboBox()
@@ -52,12 +70,22 @@ class CameraWindow(QtWidgets.QWidget):
         self.image_display.setLevels(100, 500)
         self.combobox_fwhm.addItem("no FWHM(ROI)")
         self.combobox_fwhm.addItem("FWHM(1D)")
+        self.combobox_fwhm.addItem("FWHM(1D, fast)")
+        self.combobox_fwhm.addItem("PSF metrics(L,R)")
         ini_image = np.random.randint(100, 200, size=self.cam_image_dims, dtype='uint16')
         self.image_display.setImage(ini_image, autoRange=False, autoLevels=False, autoHistogramRange=False)
+        self.plot_histogram.setFixedHeight(120)
+        self.plot_histogram.setLabel('bottom', 'pixel value')
+        self.plot_histogram.hideAxis('left')
+        self.plot_histogram.setMouseEnabled(x=False, y=False)
+        for line in self.lines_levels:
+            self.plot_histogram.addItem(line)
         self.layout.addWidget(self.image_display, 0, 0, 1, 6)
-        self.layout.addWidget(self.button_cam_snap, 1, 0)
-        self.layout.addWidget(self.combobox_fwhm, 1, 1)
-        self.layout.addWidget(self.button_cam_live, 2, 0)
+        self.layout.addWidget(self.plot_histogram, 1, 0, 1, 6)
+        self.layout.addWidget(self.button_cam_snap, 2, 0)
+        self.layout.addWidget(self.combobox_fwhm, 2, 1)
+        self.layout.addWidget(self.checkbox_auto_contrast, 2, 2)
+        self.layout.addWidget(self.button_cam_live, 3, 0)
         self.setLayout(self.layout)
         self.setFixedSize(self.layout.sizeHint())
 
@@ -68,11 +96,11 @@ class CameraWindow(QtWidgets.QWidget):
         roi_height_px = int(roi_height_um / config.microscope['um_per_px'])
         grid_spacing_px = int(grid_spacing_um / config.microscope['um_per_px'])
         dm_diameter_px = int(1000. * config.dm['diameter_mm'] / config.camera['pixel_um'])
-        roi_L = pg.RectROI([self.cam_sensor_dims[1]/8.0,
+        self.roi_L = pg.RectROI([self.cam_sensor_dims[1]/8.0,
                             self.cam_sensor_dims[0]/2.0 - int(roi_height_px / 2)],
                            [self.cam_sensor_dims[1]/4.0,
                             roi_height_px], movable=False)
-        roi_R = pg.RectROI([self.cam_sensor_dims[1]/8.0 + self.cam_sensor_dims[1]/2.0,
+        self.roi_R = pg.RectROI([self.cam_sensor_dims[1]/8.0 + self.cam_sensor_dims[1]/2.0,
                             self.cam_sensor_dims[0] / 2.0 - int(roi_height_px / 2)],
                            [self.cam_sensor_dims[1]/4.0,
                             roi_height_px], movable=False)
@@ -101,8 +129,9 @@ class CameraWindow(QtWidgets.QWidget):
             self.image_display.getView().addItem(roi_hline)
             self.image_display.getView().addItem(text_hline)
 
-        self.image_display.getView().addItem(roi_L)
-        self.image_display.getView().addItem(roi_R)
+        self.image_display.getView().addItem(self.roi_L)
+        self.image_display.getView().addItem(self.roi_R)
+        self.image_display.getView().addItem(self.scatter_beads)
         self.image_display.getView().addItem(roi_circle)
         self.image_display.getView().addItem(roi_vline)
         self.image_display.getView().addItem(self.roi_line_fwhm)
@@ -114,12 +143,22 @@ class CameraWindow(QtWidgets.QWidget):
         self.sig_update_metrics.connect(self.compute_fwhm)
 
     def compute_fwhm(self):
-        if self.combobox_fwhm.currentText() == "FWHM(1D)":
-            im = self.image_display.getImageItem()
-            self.roi_line_fwhm_data = self.roi_line_fwhm.getArrayRegion(im.image, im)
-            avg_array = self.roi_line_fwhm_data.mean(axis=1)
+        if self.combobox_fwhm.currentText() in ("FWHM(1D)", "FWHM(1D, fast)"):
+            # profile from the full-resolution frame, not the binned display image
+            image, position = self.parent.worker_display.last_image, self.parent.worker_display.last_position
+            if image is None:
+                return
+            length, width = self.roi_line_fwhm.size()
+            start = self.roi_line_fwhm.mapToParent(QtCore.QPointF(0, width / 2.0))
+            end = self.roi_line_fwhm.mapToParent(QtCore.QPointF(length, width / 2.0))
+            avg_array = image_display.line_profile(image, position, (start.x(), start.y()), (end.x(), end.y()),
+                                                   width)
+            self.roi_line_fwhm_data = avg_array
             try:
-                _, fwhm = self.compute_fwhm_1d(avg_array)
+                if self.combobox_fwhm.currentText() == "FWHM(1D, fast)":
+                    _, fwhm = self.compute_fwhm_1d_fast(avg_array)
+                else:
+                    _, fwhm = self.compute_fwhm_1d(avg_array)
             except ValueError as e:
                 fwhm = 0
             fwhm_um = fwhm * config.microscope['um_per_px']
@@ -127,6 +166,45 @@ class CameraWindow(QtWidgets.QWidget):
             roi_pos = self.roi_line_fwhm.pos()
             self.roi_fwhm_text.setPos(roi_pos)
 
+    def get_view_rois(self):
+        """Return {view name: (x, y, width, height)} of the left and right view ROIs."""
+        return {view: (roi.pos()[0], roi.pos()[1], roi.size()[0], roi.size()[1])
+                for view, roi in (('L', self.roi_L), ('R', self.roi_R))}
+
+    @QtCore.pyqtSlot(object)
+    def show_psf_metrics(self, beads):
+        """Overlay PSF metrics of the beads, computed by the metrics worker.
+        :param beads: list of dictionaries returned by psf_metrics.measure_views(), or empty list to clear.
+        """
+        if self.combobox_fwhm.currentText() != "PSF metrics(L,R)":
+            beads = []
+        self.scatter_beads.setData([bead['x'] for bead in beads], [bead['y'] for bead in beads])
+        while len(self.text_beads) < len(beads):
+            text = pg.TextItem(color=(0, 200, 200))
+            self.image_display.getView().addItem(text)
+            self.text_beads.append(text)
+        um_per_px = config.microscope['um_per_px']
+        for i, text in enumerate(self.text_beads):
+            if i < len(beads):
+                bead = beads[i]
+                text.setText(f"{bead['view']}: FWHM x,y {bead['fwhm_x_px'] * um_per_px:.2f}, "
+                             f"{bead['fwhm_y_px'] * um_per_px:.2f} um\n"
+                             f"peak {bead['peak']:.0f}, metric {bead['metric']:.3f}")
+                text.setPos(bead['x'] + 10, bead['y'] + 10)
+                text.show()
+            else:
+                text.hide()
+
+    def update_histogram(self, edges, counts, levels):
+        """Plot the sampled histogram around the populated range, with the auto-contrast levels."""
+        populated = np.nonzero(counts)[0]
+        if len(populated) == 0:
+            return
+        i_min, i_max = populated[0], populated[-1] + 1
+        self.curve_histogram.setData(edges[i_min:i_max + 1], counts[i_min:i_max], stepMode=True)
+        for line, level in zip(self.lines_levels, levels):
+            line.setValue(level)
+
     def sigma2fwhm(self, sigma):
         return 2.0 * sigma * np.sqrt(2 * np.log(2))
 
@@ -141,6 +219,12 @@ class CameraWindow(QtWidgets.QWidget):
         g = offset + amplitude * np.exp(- ((x - xo) ** 2) / (2 * sigma_x ** 2))
         return g.ravel()
 
+    def compute_fwhm_1d_fast(self, arr):
+        """Closed-form estimate from the second moments of the profile, see optimization.get_FWHM_1d_moments().
+        Agrees with compute_fwhm_1d() within a few percent, in a fraction of its time."""
+        xcenter, sigma_x = optimization.get_FWHM_1d_moments(self.normalize_array(arr))
+        return xcenter, self.sigma2fwhm(sigma_x)
+
     def compute_fwhm_1d(self, arr):
         arr_norm = self.normalize_array(arr)
         x = np.linspace(0, arr_norm.shape[0] - 1, arr_norm.shape[0]) + 0.5
@@ -171,6 +255,8 @@ def get_dirname(path): return '.../' + os.path.basename(os.path.normpath(path))
 
 class MainWindow(QtWidgets.QWidget):
     """Wiring up all controls together"""
+    sig_view_changed = pyqtSignal(object, object)
+
     def __init__(self, logger_name='main_window'):
         super().__init__()
         self.cam_window = None
@@ -185,8 +271,10 @@ class MainWindow(QtWidgets.QWidget):
         self.n_angles = 2
         self.tile_step_um = config.microscope['FOV_x_um'] * (1 - config.scanning['tile_overlap_ratio'])
         self.file_save_running = self.abort_pressed = False
-        self.root_folder = config.saving['root_folder']
+        self.root_folders = list(config.saving['root_folder'])  # several folders (disks) for striped saving
+        self.root_folder = self.root_folders[0]
         self.dir_path = self.file_path = None
+        self.part_file_paths = []
         self.plane_order = 'interleaved'
         self.file_format = "HDF5"
 
@@ -203,6 +291,10 @@ class MainWindow(QtWidgets.QWidget):
         self.gui_expt = loadUi("gui/experiment.ui")
         # deformable mirror widgets
         self.dev_dm = def_mirror.DmController(logger_name=self.logger.name + '.DM')
+        self.dm_library = command_library.CommandLibrary(config.dm_library['file'], config.dm_library['scales'])
+        self.button_dm_library_apply = QtWidgets.QPushButton('Apply closest command from library')
+        self.button_dm_library_save = QtWidgets.QPushButton('Save current command to library')
+        self.last_psf_metrics = []
         # light-sheet widget
         self.ls_generator = lsg.LightsheetGenerator()
         # stage widgets
@@ -225,6 +317,7 @@ class MainWindow(QtWidgets.QWidget):
         self.initUI()
 
         # Set up threads and signals
+        self.frame_mailbox = image_display.FrameMailbox()
         self.thread_live_mode = QtCore.QThread()
         self.worker_live_mode = LiveImagingWorker(self, self.dev_cam)
         self.worker_live_mode.moveToThread(self.thread_live_mode)
@@ -244,12 +337,36 @@ class MainWindow(QtWidgets.QWidget):
         self.worker_grabbing.sig_save_data.connect(self.append_new_data)
         self.worker_grabbing.sig_finished.connect(self.thread_frame_grabbing.quit)
 
+        self.thread_dm_update = QtCore.QThread()
+        self.worker_dm_update = DmUpdateWorker(self.dev_dm)
+        self.worker_dm_update.moveToThread(self.thread_dm_update)
+        self.worker_grabbing.sig_dm_command.connect(self.worker_dm_update.apply)
+        self.thread_dm_update.start()
+
         self.thread_stage_scanning = QtCore.QThread()
         self.worker_stage_scanning = StageScanningWorker(self, self.logger)
         self.worker_stage_scanning.moveToThread(self.thread_stage_scanning)
         self.thread_stage_scanning.started.connect(self.worker_stage_scanning.scan)
         self.worker_stage_scanning.finished.connect(self.thread_stage_scanning.quit)
 
+        self.thread_display = QtCore.QThread()
+        self.worker_display = DisplayWorker(self.frame_mailbox)
+        self.worker_display.moveToThread(self.thread_display)
+        self.thread_display.started.connect(self.worker_display.start)
+        self.sig_view_changed.connect(self.worker_display.set_view)
+        self.worker_display.sig_image_ready.connect(self.show_image)
+        self.cam_window.image_display.getView().sigRangeChanged.connect(self.view_changed)
+        self.thread_display.start()
+
+        self.thread_psf_metrics = QtCore.QThread()
+        self.worker_psf_metrics = PsfMetricsWorker(self.cam_window.get_view_rois(), self.logger)
+        self.worker_psf_metrics.moveToThread(self.thread_psf_metrics)
+        self.thread_psf_metrics.started.connect(self.worker_psf_metrics.start)
+        self.worker_psf_metrics.sig_metrics_ready.connect(self.cam_window.show_psf_metrics)
+        self.worker_psf_metrics.sig_metrics_ready.connect(self.update_last_psf_metrics)
+        self.cam_window.combobox_fwhm.currentTextChanged.connect(self.psf_metrics_mode_changed)
+        self.thread_psf_metrics.start()
+
     def initUI(self):
         self.setLocale(QtCore.QLocale(QtCore.QLocale.English, QtCore.QLocale.UnitedStates))
         self.setWindowTitle("Microscope control")
@@ -264,9 +381,11 @@ class MainWindow(QtWidgets.QWidget):
         # Experiment tab
         self.tab_expt.layout.addWidget(self.gui_expt)
         self.tab_expt.setLayout(self.tab_expt.layout)
-        self.gui_expt.button_save_folder.setText(get_dirname(config.saving['root_folder']))
+        self.gui_expt.button_save_folder.setText(get_dirname(self.root_folder))
         # DM tab
         self.tab_defm.layout.addWidget(self.dev_dm.gui)
+        self.tab_defm.layout.addWidget(self.button_dm_library_apply)
+        self.tab_defm.layout.addWidget(self.button_dm_library_save)
         self.tab_defm.setLayout(self.tab_defm.layout)
         # ETL tab
         self.tab_etl.layout.addWidget(self.dev_etl.gui)
@@ -300,6 +419,8 @@ class MainWindow(QtWidgets.QWidget):
         self.gui_expt.spinbox_n_timepoints.valueChanged.connect(self.update_calculator)
         self.gui_expt.combo_plane_order.currentIndexChanged.connect(self.set_plane_order)
         self.button_exit.clicked.connect(self.button_exit_clicked)
+        self.button_dm_library_apply.clicked.connect(self.dm_library_apply)
+        self.button_dm_library_save.clicked.connect(self.dm_library_save)
         # Signals Camera control
         self.cam_window.button_cam_snap.clicked.connect(self.button_snap_clicked)
         self.cam_window.button_cam_live.clicked.connect(self.button_live_clicked)
@@ -401,8 +522,16 @@ class MainWindow(QtWidgets.QWidget):
     def button_exit_clicked(self):
         if self.dev_cam.dev_handle is not None:
             self.dev_cam.dev_handle.shutdown()
+        self.thread_dm_update.quit()  # pending DM commands are applied before the mirror is closed
+        self.thread_dm_update.wait()
         if self.dev_dm.dev_handle is not None:
             self.dev_dm.close()
+        QtCore.QMetaObject.invokeMethod(self.worker_display, 'stop', QtCore.Qt.BlockingQueuedConnection)
+        self.thread_display.quit()
+        self.thread_display.wait()
+        QtCore.QMetaObject.invokeMethod(self.worker_psf_metrics, 'stop', QtCore.Qt.BlockingQueuedConnection)
+        self.thread_psf_metrics.quit()
+        self.thread_psf_metrics.wait()
         self.cam_window.close()
         self.close()
 
@@ -412,18 +541,113 @@ class MainWindow(QtWidgets.QWidget):
 
     def display_image(self, image, position=None, text_update=False):
         """
-        Update the GUI with new image from the camera.
+        Update the GUI with new image from the camera. The image goes to the frame mailbox, from where the display
+        worker picks it up at the screen refresh rate, reduces it to the screen resolution and passes to show_image().
         :param image: 2-dim numpy array, full resolution, 'uint16' type.
         :param text_update: print image min and max in log window (default False)
         :param position: tuple of image (x,y) position.
         :return: None
         """
-        self.cam_window.image_display.setImage(image.T, autoRange=False, autoLevels=False,
-                                    pos=position, autoHistogramRange=False)
-        self.cam_window.sig_update_metrics.emit()
+        self.frame_mailbox.put(image, position)
         if text_update:
             self.logger.info("(min, max): (" + str(image.min()) + "," + str(image.max()) + ")\n")
 
+    @QtCore.pyqtSlot(object, object, object, object)
+    def show_image(self, image, position, scale, histogram):
+        """Show the image prepared by the display worker, binned by scale and placed at position.
+        :param histogram: (bin edges, counts, (low, high) auto-contrast levels) from the display worker.
+        """
+        edges, counts, levels = histogram
+        self.cam_window.display_scale = scale
+        if self.cam_window.checkbox_auto_contrast.isChecked():
+            self.cam_window.image_display.setImage(image.T, autoRange=False, autoLevels=False, levels=levels,
+                                                   pos=position, scale=(scale, scale), autoHistogramRange=False)
+        else:
+            self.cam_window.image_display.setImage(image.T, autoRange=False, autoLevels=False,
+                                                   pos=position, scale=(scale, scale), autoHistogramRange=False)
+        self.cam_window.update_histogram(edges, counts, levels)
+        self.cam_window.sig_update_metrics.emit()
+        self.worker_display.gui_busy = False
+
+    def psf_metrics_mode_changed(self, text):
+        """Pass frames to the PSF metrics worker only when its overlay is selected."""
+        if text == "PSF metrics(L,R)":
+            self.worker_display.metrics_mailbox = self.worker_psf_metrics.frame_mailbox
+        else:
+            self.worker_display.metrics_mailbox = None
+            self.cam_window.show_psf_metrics([])
+            self.last_psf_metrics = []  # stale metrics must not be saved with a later DM command
+
+    def update_last_psf_metrics(self, beads):
+        self.last_psf_metrics = beads
+
+    def get_imaging_conditions(self):
+        """Conditions indexing the DM command library: sample settings from config.dm_library,
+        ETL current and stage position read from the devices, if connected."""
+        conditions = {key: config.dm_library[key] for key in ('chamber', 'coverslip_tilt_deg', 'wavelength_nm')}
+        if self.dev_etl._ser is not None:
+            conditions['etl_current_mA'] = self.dev_etl.get_current()
+        if self.dev_stage.initialized:
+            self.dev_stage.get_position()
+            conditions['stage_x_mm'] = self.dev_stage.position_x_mm
+            conditions['stage_y_mm'] = self.dev_stage.position_y_mm
+        return conditions
+
+    def dm_library_apply(self):
+        """Apply the command optimized under conditions closest to the current ones, as a warm start."""
+        conditions = self.get_imaging_conditions()
+        command, entry = self.dm_library.closest(conditions, serial=config.dm_library['mirror_serial'],
+                                                 max_distance=config.dm_library['max_distance'])
+        if command is None:
+            self.logger.error(f"No DM command in the library close to conditions {conditions}")
+        else:
+            self.dev_dm.command = command
+            self.dev_dm.apply_cmd(command)
+            self.logger.info(f"DM command #{entry['id']} applied, optimized {entry['timestamp']} "
+                             f"under {entry['conditions']}, metric {entry['metric']:.3g}")
+
+    def get_dm_scan_commands(self):
+        """DM commands for each scan line, interpolated from library commands optimized at other stage positions
+        under the current conditions. None if disabled in config.dm_library or there are no such commands."""
+        if not config.dm_library['correction_map_during_scan']:
+            return None
+        if not self.dev_stage.initialized or self.dev_dm.dev_handle is None:
+            self.logger.error("DM correction map: stage and DM must be initialized, map not used.")
+            return None
+        correction = correction_map.CorrectionMap.from_library(self.dm_library, self.get_imaging_conditions(),
+                                                               serial=config.dm_library['mirror_serial'],
+                                                               max_distance=config.dm_library['max_distance'])
+        if correction is None:
+            self.logger.error("DM correction map: no library commands with stage positions under similar conditions,"
+                              " map not used.")
+            return None
+        try:
+            commands = correction.tile_commands(self.dev_stage.scan_line_positions())
+        except ValueError as e:
+            self.logger.error(f"DM correction map not used: {e}")
+            return None
+        self.logger.info(f"DM correction map: {len(correction.positions)} positions, "
+                         f"commands interpolated for {len(commands)} scan lines")
+        return commands
+
+    def dm_library_save(self):
+        """Save the current DM command with current conditions and the mean metric of the beads on screen.
+        Refused without a metric (PSF metrics overlay off, or no beads measured), since entries are ranked by it."""
+        metrics = np.array([bead['metric'] for bead in self.last_psf_metrics], dtype=np.float64)
+        if not np.any(np.isfinite(metrics)):
+            self.logger.error("DM command not saved: no bead metrics, select 'PSF metrics(L,R)' with beads in view")
+            return
+        metric = np.nanmean(metrics)
+        entry_id = self.dm_library.add(self.dev_dm.command, self.get_imaging_conditions(), metric,
+                                       metric_name=config.psf_metrics['method1'],
+                                       serial=config.dm_library['mirror_serial'])
+        self.logger.info(f"DM command saved to library as #{entry_id}, metric {metric:.3g}")
+
+    def view_changed(self):
+        """Pass the visible region and on-screen size of the image view to the display worker."""
+        view_box = self.cam_window.image_display.getView()
+        self.sig_view_changed.emit(view_box.viewRange(), (view_box.width(), view_box.height()))
+
     def button_live_clicked(self):
         if not self.dev_cam.status == 'Running':
             self.dev_cam.status = 'Running'
@@ -441,17 +665,22 @@ class MainWindow(QtWidgets.QWidget):
         '''
         # start acquisition
         if (not self.abort_pressed) and (self.dev_cam.status != 'Running') and (not self.file_save_running):
+            self.n_frames_per_stack = int(self.gui_expt.spinbox_frames_per_stack.value())
+            self.n_frames_to_grab = self.n_timepoints * self.n_angles * self.n_tiles * self.n_frames_per_stack
+            if not self.check_disks():
+                return
             self.create_folder()
             self.check_cam_initialized()
             self.dev_cam.status = 'Running'
             self.button_acquire_reset()
-            self.n_frames_per_stack = int(self.gui_expt.spinbox_frames_per_stack.value())
-            self.n_frames_to_grab = self.n_timepoints * self.n_angles * self.n_tiles * self.n_frames_per_stack
             self.dev_cam.setup()
             self.ls_generator.setup()
-            self.worker_grabbing.setup(self.n_frames_to_grab)
             self.worker_saving.setup(self.n_frames_to_grab, self.n_frames_per_stack,
                                      self.n_angles, self.n_tiles, self.dev_cam.frame_height_px)
+            dm_commands = self.get_dm_scan_commands()
+            frames_per_line = self.n_frames_to_grab // (self.n_timepoints * max(1, self.dev_stage.n_scan_lines))
+            self.worker_grabbing.setup(self.n_frames_to_grab, frame_buffer=self.worker_saving.frame_buffer,
+                                       dm=self.dev_dm, dm_commands=dm_commands, frames_per_line=frames_per_line)
             self.thread_frame_grabbing.start()
             self.thread_saving_files.start()
             if not self.dev_cam.config['simulation']:
@@ -464,6 +693,23 @@ class MainWindow(QtWidgets.QWidget):
             self.thread_frame_grabbing.wait()
             self.thread_saving_files.wait()
 
+    def check_disks(self):
+        """Pre-flight check: free space and write speed of the saving disk(s) for the planned acquisition."""
+        if not config.saving['preflight_check']:
+            return True
+        ok, messages = preflight.check_disks(self.root_folders, self.n_frames_to_grab,
+                                             (self.dev_cam.frame_height_px, 2048), self.dev_cam.exposure_ms,
+                                             margin=config.saving['preflight_margin'],
+                                             test_size_mb=config.saving['preflight_test_mb'])
+        for msg in messages:
+            if ok:
+                self.logger.info(msg)
+            else:
+                self.logger.error(msg)
+        if not ok:
+            self.logger.error("Acquisition not started: saving disk(s) cannot keep up.")
+        return ok
+
     def check_cam_initialized(self):
         if self.dev_cam.config['simulation']:
             pass
@@ -472,14 +718,22 @@ class MainWindow(QtWidgets.QWidget):
             self.abort_pressed = True
 
     def create_folder(self):
-        """Create new folder for acquisition."""
-        self.dir_path = self.root_folder + "/" + self.gui_expt.line_subfolder.text()
+        """Create new folder for acquisition, in every root folder if saving is striped over several disks.
+        The master file goes into the first root folder."""
+        dir_paths = [root + "/" + self.gui_expt.line_subfolder.text() for root in self.root_folders]
         i_dir = 0
-        while os.path.exists(self.dir_path + f'_v{i_dir}'): i_dir += 1
-        self.dir_path += f'_v{i_dir}'
-        os.mkdir(self.dir_path)
+        while any([os.path.exists(path + f'_v{i_dir}') for path in dir_paths]): i_dir += 1
+        dir_paths = [path + f'_v{i_dir}' for path in dir_paths]
+        for path in dir_paths:
+            os.mkdir(path)
+        self.dir_path = dir_paths[0]
         self.file_path = self.dir_path + "/" + self.gui_expt.line_prefix.text()
-        self.logger.info("Experiment folder: " + self.dir_path)
+        if len(dir_paths) > 1:
+            self.part_file_paths = [path + "/" + self.gui_expt.line_prefix.text() + f"_part{i}"
+                                    for i, path in enumerate(dir_paths)]
+        else:
+            self.part_file_paths = []
+        self.logger.info("Experiment folder: " + ", ".join(dir_paths))
 
     def button_acquire_reset(self):
         if (not self.dev_cam.status == 'Running') and (not self.file_save_running):
@@ -497,7 +751,7 @@ class MainWindow(QtWidgets.QWidget):
         file_dialog.setFileMode(QtWidgets.QFileDialog.Directory)
         folder = file_dialog.getExistingDirectory(self, "Save to folder", self.root_folder)
         if folder:
-            self.root_folder = folder
+            self.root_folder = self.root_folders[0] = folder
             self.gui_expt.button_save_folder.setText(get_dirname(folder))
             self.logger.info("Root folder for saving: " + self.root_folder)
 
@@ -513,7 +767,7 @@ class MainWindow(QtWidgets.QWidget):
 
 class LiveImagingWorker(QtCore.QObject):
     """
-    Acquire one image at a time and display it.
+    Keep the camera streaming and post the newest frame to the display mailbox, at the camera frame rate.
     """
     sig_finished = pyqtSignal()
 
@@ -524,12 +778,127 @@ class LiveImagingWorker(QtCore.QObject):
 
     @QtCore.pyqtSlot()
     def update(self):
+        self.camera.start_live()
         while self.camera.status == 'Running':
-            self.parent_window.button_snap_clicked()
-            time.sleep(0.2) # Todo: Replace with QTimer!!!
+            if self.camera.get_live_frame():
+                self.parent_window.frame_mailbox.put(self.camera.last_image, (0, self.camera.cam_voffset))
+        self.camera.stop_live()
         self.sig_finished.emit()
 
 
+class DisplayWorker(QtCore.QObject):
+    """
+    Reduce camera frames to the on-screen resolution of the image view, off the GUI thread.
+    Full resolution is used only when zoomed in.
+    Frames are pulled from the mailbox at refresh_rate_hz, and only when the GUI has shown the previous one,
+    so a slow GUI drops frames instead of queueing them. If the GUI does not confirm a frame within gui_timeout_s
+    (e.g. show_image() raised), the handshake is reset, so the display cannot freeze.
+    Each new frame updates a sampled histogram, which gives the auto-contrast levels at low_high_percentiles.
+    """
+    sig_image_ready = pyqtSignal(object, object, object, object)
+
+    def __init__(self, frame_mailbox, refresh_rate_hz=30, low_high_percentiles=(1.0, 99.9), gui_timeout_s=1.0):
+        super().__init__()
+        self.frame_mailbox = frame_mailbox
+        self.refresh_rate_hz = refresh_rate_hz
+        self.histogram = image_display.SampledHistogram()
+        self.low_high_percentiles = low_high_percentiles
+        self.timer = None
+        self.gui_busy = False
+        self.gui_timeout_s = gui_timeout_s
+        self.render_time = 0
+        self.metrics_mailbox = None  # full-resolution frames are forwarded here, if set
+        self.view_range = None
+        self.view_size_px = (1200, 800)
+        self.last_image = self.last_position = None
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        self.timer = QtCore.QTimer()  # created here to live in the display thread
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(int(1000 / self.refresh_rate_hz))
+
+    @QtCore.pyqtSlot()
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+    @QtCore.pyqtSlot()
+    def poll(self):
+        if self.gui_busy:
+            if time.time() - self.render_time < self.gui_timeout_s:
+                return
+            self.gui_busy = False  # frame was never shown, don't wait for it forever
+        item = self.frame_mailbox.take()
+        if item is not None:
+            if self.metrics_mailbox is not None:
+                self.metrics_mailbox.put(*item)
+            self.render(*item)
+
+    @QtCore.pyqtSlot(object, object)
+    def set_view(self, view_range, view_size_px):
+        self.view_range = view_range
+        if view_size_px[0] > 0 and view_size_px[1] > 0:
+            self.view_size_px = view_size_px
+        if self.last_image is not None:  # re-render the last image at new zoom
+            self.render(self.last_image, self.last_position, new_frame=False)
+
+    def render(self, image, position, new_frame=True):
+        self.last_image, self.last_position = image, position
+        self.gui_busy = True
+        self.render_time = time.time()
+        if new_frame:
+            self.histogram.update(image)
+        levels = tuple(self.histogram.percentile(self.low_high_percentiles))
+        image_binned, position_binned, scale = image_display.decimate_for_display(image, position, self.view_range,
+                                                                                  self.view_size_px)
+        self.sig_image_ready.emit(image_binned, position_binned, scale,
+                                  (self.histogram.edges, self.histogram.counts.copy(), levels))
+
+
+class PsfMetricsWorker(QtCore.QObject):
+    """
+    Find beads in the left and right view ROIs and compute their FWHM, peak and optimization metric,
+    in a background thread. Frames come from the display worker via mailbox, so only the newest frame
+    is measured every config.psf_metrics['update_interval_s'].
+    """
+    sig_metrics_ready = pyqtSignal(object)
+
+    def __init__(self, view_rois, logger):
+        super().__init__()
+        self.view_rois = view_rois
+        self.logger = logger
+        self.settings = config.psf_metrics
+        self.metric_settings = psf_metrics.metric_settings_from_config(self.settings)
+        self.metric_context = optimization.MetricContext(self.metric_settings)
+        self.frame_mailbox = image_display.FrameMailbox()
+        self.timer = None
+
+    @QtCore.pyqtSlot()
+    def start(self):
+        self.timer = QtCore.QTimer()  # created here to live in the metrics thread
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(int(1000 * self.settings['update_interval_s']))
+
+    @QtCore.pyqtSlot()
+    def stop(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+    @QtCore.pyqtSlot()
+    def poll(self):
+        item = self.frame_mailbox.take()
+        if item is not None:
+            image, position = item
+            try:
+                beads = psf_metrics.measure_views(image, position, self.view_rois, self.settings,
+                                                  self.metric_settings, self.metric_context)
+            except ValueError as e:
+                self.logger.error(f"PSF metrics: {e}")
+                beads = []
+            self.sig_metrics_ready.emit(beads)
+
+
 class StageScanningWorker(QtCore.QObject):
     """
     Scan the stage multiple cycles. Proper use of QThread via worker object.
@@ -570,7 +939,7 @@ class CameraFrameGrabbingWorker(QtCore.QObject):
     """
     sig_update_GUI = pyqtSignal()
     sig_save_data = pyqtSignal(object)
-    sig_display_image = pyqtSignal(object)
+    sig_dm_command = pyqtSignal(object)
     sig_finished = pyqtSignal()
 
     def __init__(self, parent_window, camera, logger):
@@ -579,29 +948,64 @@ class CameraFrameGrabbingWorker(QtCore.QObject):
         self.camera = camera
         self.logger = logger
         self.sig_update_GUI.connect(self.parent_window.button_acquire_reset)
-        self.sig_display_image.connect(self.parent_window.display_image)
-        self.gui_update_interval_s = 1.0
+        self.frame_mailbox = self.parent_window.frame_mailbox
         self.n_frames_to_grab = None
         self.n_frames_grabbed = None
-
-    def setup(self, n_frames_to_grab):
+        self.frame_buffer = None
+        self.dm = None
+        self.dm_commands = None
+        self.frames_per_line = None
+        self.i_line = None
+
+    def setup(self, n_frames_to_grab, frame_buffer=None, dm=None, dm_commands=None, frames_per_line=None):
+        """If frame_buffer (shared memory) is given, frames go directly into it for the saving process.
+        Otherwise they are emitted to the saving queue via sig_save_data.
+        If dm_commands (one per scan line) are given, the DM command of the next line is sent to the DM thread
+        (DmUpdateWorker) as soon as all frames of the current line are grabbed, so that the mirror settles while
+        the stage returns to the start of the next line, and grabbing does not wait for the DLL call.
+        The command of the first line is applied here, before grabbing starts."""
         self.n_frames_to_grab = n_frames_to_grab
         self.n_frames_grabbed = 0
+        self.frame_buffer = frame_buffer
+        self.dm = dm
+        self.dm_commands = dm_commands
+        self.frames_per_line = frames_per_line
+        self.i_line = None
+        if self.dm_commands is not None:
+            self.i_line = 0
+            self.dm.command = self.dm_commands[0]
+            self.dm.apply_cmd(self.dm.command)
+
+    def update_dm(self):
+        """Send the DM command of the current scan line to the DM thread, if it changed."""
+        if self.dm_commands is None or self.n_frames_grabbed >= self.n_frames_to_grab:
+            return
+        i_line = (self.n_frames_grabbed // max(1, self.frames_per_line)) % len(self.dm_commands)
+        if i_line != self.i_line:
+            self.i_line = i_line
+            self.sig_dm_command.emit(self.dm_commands[i_line])
+
+    def save_frames(self, frame_data):
+        if self.frame_buffer is None:
+            self.sig_save_data.emit(frame_data)
+        else:
+            for frame in frame_data:
+                if not self.frame_buffer.put(frame):
+                    self.logger.error("Saving buffer full, frame dropped")
 
     @QtCore.pyqtSlot()
     def run(self):
         if not self.camera.config['simulation']:
             self.camera.dev_handle.startAcquisition()
         self.logger.info("Camera started")
-        gui_update_time = time.time()
-        fps_count_time = gui_update_time
+        fps_count_time = time.time()
         while (self.camera.status == 'Running') and (self.n_frames_grabbed < self.n_frames_to_grab):
             if self.camera.config['simulation']:
                 self.n_frames_grabbed += 1
                 sim_image_16bit = np.random.randint(100, 200, size=2048 * 2048, dtype='uint16')
                 frame_data = [sim_image_16bit]
-                self.sig_save_data.emit(frame_data)
-                self.sig_display_image.emit(np.reshape(frame_data, self.camera.config['image_shape']))
+                self.save_frames(frame_data)
+                self.frame_mailbox.put(np.reshape(frame_data, self.camera.config['image_shape']))
             else:
                 [frames, dims] = self.camera.dev_handle.getFrames()
                 self.n_frames_grabbed += len(frames)
@@ -609,12 +1013,13 @@ class CameraFrameGrabbingWorker(QtCore.QObject):
                     frame_data = []
                     for frame in frames:
                         frame_data.append(frame.getData())
-                    self.sig_save_data.emit(frame_data)
-                    time_stamp = time.time()
-                    if (time_stamp - gui_update_time) >= self.gui_update_interval_s:
-                        gui_update_time = time.time()
-                        self.sig_display_image.emit(np.reshape(frame_data[0], dims))
+                    self.update_dm()
+                    self.save_frames(frame_data)
+                    self.frame_mailbox.put(np.reshape(frame_data[-1], dims))
         # Clean up after the main cycle is done
+        if self.frame_buffer is not None:
+            self.frame_buffer.end_stream()  # the saving process stops waiting for frames that will not come
+            self.frame_buffer = None
         if not self.camera.config['simulation']:
             self.camera.dev_handle.stopAcquisition()
             self.logger.debug(f"camera finished, mean fps {self.n_frames_to_grab/(time.time() - fps_count_time):2.1f}")
@@ -623,9 +1028,24 @@ class CameraFrameGrabbingWorker(QtCore.QObject):
         self.sig_finished.emit()
 
 
+class DmUpdateWorker(QtCore.QObject):
+    """
+    Apply DM commands in a separate thread. mro_applySmoothCommand() blocks until the DLL has sent the command,
+    which would otherwise delay getFrames() in the grabbing loop, risking camera buffer overruns.
+    """
+    def __init__(self, dm):
+        super().__init__()
+        self.dm = dm
+
+    @QtCore.pyqtSlot(object)
+    def apply(self, command):
+        self.dm.command = command
+        self.dm.apply_cmd(command)
+
+
 class SavingStacksWorker(QtCore.QObject):
     """
-    Save stacks to files
+    Save stacks to files, either in this thread or in a separate saving process (config.saving['separate_process']).
     """
     sig_update_GUI = pyqtSignal()
     sig_finished = pyqtSignal()
@@ -636,122 +1056,87 @@ class SavingStacksWorker(QtCore.QObject):
         self.camera = camera
         self.logger = logger
         self.frame_queue = frame_queue
-        self.frames_to_save = self.frames_per_stack = self.n_angles = self.frame_counter = None
-        self.stack_counter = self.angle_counter = self.bdv_writer = self.stack = self.cam_image_height = None
+        self.writer = self.frame_buffer = self.cam_image_height = None
+        self.use_process = config.saving['separate_process']
+        if self.use_process and stack_writer.shared_memory is None:
+            self.logger.warning("Shared memory not available (Python < 3.8), files will be saved in a thread")
+            self.use_process = False
         self.sig_update_GUI.connect(self.parent_window.button_acquire_reset)
 
     def setup(self, frames_to_save, frames_per_stack, n_angles, n_tiles, image_height):
-        self.frames_to_save = frames_to_save
-        self.frames_per_stack = frames_per_stack
-        self.n_angles = n_angles
-        self.n_tiles = n_tiles
-        self.frame_counter = self.stack_counter = self.angle_counter = 0
-        self.tile_counter = self.tile_counter_new = 0
-        self.planes_interleaved = True if self.parent_window.plane_order == "interleaved" else False
         self.cam_image_height = image_height
-        self.stack = np.empty((frames_per_stack, self.cam_image_height, 2048), 'uint16')
-        self.bdv_writer = npy2bdv.BdvWriter(self.parent_window.file_path + '.h5',
-                                            nangles=self.n_angles, ntiles=self.n_tiles)
-        if not self.planes_interleaved:
+        planes_interleaved = True if self.parent_window.plane_order == "interleaved" else False
+        if not planes_interleaved:
             z_voxel_size = self.parent_window.gui_stage.spinbox_stage_step_x.value() / np.sqrt(2)
         else:
             z_voxel_size = 2 * self.parent_window.gui_stage.spinbox_stage_step_x.value() / np.sqrt(2)
-        z_anisotropy = z_voxel_size / config.microscope['um_per_px']
-        self.unshear_matrix_L = np.array(((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, -z_anisotropy, 0.0), (0.0, 0.0, 1.0, 0.0)))
-        self.unshear_matrix_R = np.array(((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, z_anisotropy, 0.0),  (0.0, 0.0, 1.0, 0.0)))
-        self.voxel_size = (config.microscope['um_per_px'], config.microscope['um_per_px'], z_voxel_size)
+        writer_args = (frames_to_save, frames_per_stack, n_angles, n_tiles, (self.cam_image_height, 2048))
+        writer_kwargs = {'planes_interleaved': planes_interleaved,
+                         'z_voxel_size_um': z_voxel_size,
+                         'um_per_px': config.microscope['um_per_px'],
+                         'tile_step_um': self.parent_window.tile_step_um,
+                         'y_stage_flip': config.scanning['y_stage_flip'],
+                         'exposure_ms': self.camera.exposure_ms}
+        if self.parent_window.part_file_paths:
+            self.writer = stack_writer.StripedBdvStackWriter(self.parent_window.file_path,
+                                                             self.parent_window.part_file_paths,
+                                                             *writer_args, stripe_by=config.saving['stripe_by'],
+                                                             **writer_kwargs)
+        else:
+            self.writer = stack_writer.BdvStackWriter(self.parent_window.file_path, *writer_args, **writer_kwargs)
+        if self.use_process:
+            self.frame_buffer = stack_writer.SharedFrameBuffer(config.saving['buffer_size_frames'],
+                                                               (self.cam_image_height, 2048))
+        else:
+            self.frame_buffer = None
 
     @QtCore.pyqtSlot()
     def run(self):
         self.parent_window.file_save_running = True
-        while not self.parent_window.abort_pressed and self.frame_counter < self.frames_to_save:
-            if len(self.frame_queue) > 0:
-                plane = np.reshape(self.frame_queue.popleft(), (self.cam_image_height, 2048))
-                if not self.planes_interleaved:  # planes are from L,L,L,L..., R,R,R,.. views
-                    if self.frame_counter % self.frames_per_stack == 0:  # begin new stack
-                        time_index = int(self.stack_counter / self.n_angles / self.n_tiles)
-                        plane_index_L = plane_index_R = -1
-                        self.angle_counter = self.angle_counter % self.n_angles
-                        if self.tile_counter_new > self.tile_counter:
-                            self.tile_counter = self.tile_counter_new
-                        self.bdv_writer.append_view(None,
-                                                    virtual_stack_dim=(self.frames_per_stack, plane.shape[0], plane.shape[1]),
-                                                    time=time_index,
-                                                    angle=self.angle_counter,
-                                                    tile=self.tile_counter,
-                                                    m_affine=self.unshear_matrix_L,
-                                                    name_affine="unshearing transformation",
-                                                    voxel_size_xyz=self.voxel_size,
-                                                    exposure_time=self.camera.exposure_ms
-                                                    )
-                        self.stack_counter += 1
-                        if self.n_tiles > 1:
-                            self.tile_counter_new = self.tile_counter + 1
-                else:  # planes interleaved, from L, R, L, R, .. views
-                    if self.frame_counter % (self.n_angles * self.frames_per_stack) == 0:  # begin 2 new stacks
-                        time_index = int(self.stack_counter / self.n_angles / self.n_tiles)
-                        plane_index_L = plane_index_R = -1
-                        if self.tile_counter_new > self.tile_counter:
-                            self.tile_counter = self.tile_counter_new
-                        self.bdv_writer.append_view(None,
-                                                    virtual_stack_dim=(self.frames_per_stack, plane.shape[0], plane.shape[1]),
-                                                    time=time_index,
-                                                    angle=0,
-                                                    tile=self.tile_counter,
-                                                    m_affine=self.unshear_matrix_L, name_affine="unshearing",
-                                                    voxel_size_xyz=self.voxel_size,
-                                                    exposure_time=self.camera.exposure_ms
-                                                    )
-                        self.bdv_writer.append_view(None,
-                                                    virtual_stack_dim=(self.frames_per_stack, plane.shape[0], plane.shape[1]),
-                                                    time=time_index,
-                                                    angle=1,
-                                                    tile=self.tile_counter,
-                                                    m_affine=self.unshear_matrix_R, name_affine="unshearing",
-                                                    voxel_size_xyz=self.voxel_size,
-                                                    exposure_time=self.camera.exposure_ms
-                                                    )
-                        if self.n_tiles > 1:
-                            self.tile_counter_new = self.tile_counter + 1
-                        self.stack_counter += 2
-
-                    self.angle_counter = self.frame_counter % self.n_angles # -> angle 0/1 for even/odd plane
-                # common block for both plane interleave modes:
-                if self.angle_counter % self.n_angles == 0:
-                    plane_index_L += 1
-                    plane_index = plane_index_L
-                else:
-                    plane_index_R += 1
-                    plane_index = plane_index_R
-                #print(f"Debug: plane {plane_index}, time {time_index}, tile {self.tile_counter}/{self.n_tiles}, angle {self.angle_counter}")
-                self.bdv_writer.append_plane(plane=plane, z=plane_index, time=time_index,
-                                             tile=self.tile_counter, angle=self.angle_counter)
-                self.frame_counter += 1
-            else:
-                time.sleep(0.02)  # Todo: Replace with QTimer
-        # wrap-up:
-        ntimes = int(self.stack_counter / self.n_angles / self.n_tiles)
-        #print(f"Debug: ntimes {ntimes} stack counter {self.stack_counter} ntiles {self.n_tiles}")
-        self.bdv_writer.write_xml_file(ntimes=ntimes, camera_name="OrcaFlash 4.3")
-        # write tile coordinates into XML
-        for it in range(ntimes):
-            stage_sign = -1 if config.scanning['y_stage_flip'] else 1
-            tile_offset_px = stage_sign * self.parent_window.tile_step_um / config.microscope['um_per_px']
-            #print(f"Debug: tile_offset_px {tile_offset_px}")
-            for itile in range(self.n_tiles):
-                translation_angle0 = np.array(((1.0, 0, 0, tile_offset_px * itile), (0, 1.0, 0, 0),  (0, 0, 1.0, 0)))
-                translation_angle1 = np.array(((1.0, 0, 0, -tile_offset_px * itile), (0, 1.0, 0, 0),  (0, 0, 1.0, 0)))
-                self.bdv_writer.append_affine(m_affine=translation_angle0, time=it, tile=itile, angle=0)
-                self.bdv_writer.append_affine(m_affine=translation_angle1, time=it, tile=itile, angle=1)
-        # finalize
-        self.bdv_writer.close()
+        if self.use_process:
+            n_saved, ntimes, n_stacks = self.run_process()
+        else:
+            n_saved, ntimes, n_stacks = self.run_thread()
         self.frame_queue.clear()
         self.parent_window.file_save_running = False
-        self.logger.info(f"Saved {self.frame_counter} images: {ntimes} time points,"
-                         f" {self.stack_counter} stacks, {self.n_tiles} tiles.")
+        self.logger.info(f"Saved {n_saved} images: {ntimes} time points,"
+                         f" {n_stacks} stacks, {self.writer.n_tiles} tiles.")
         self.sig_update_GUI.emit()
         self.sig_finished.emit()
 
+    def run_thread(self):
+        self.writer.open()
+        while not self.parent_window.abort_pressed and self.writer.frame_counter < self.writer.frames_to_save:
+            if len(self.frame_queue) > 0:
+                plane = np.reshape(self.frame_queue.popleft(), (self.cam_image_height, 2048))
+                self.writer.write_plane(plane)
+            else:
+                time.sleep(0.02)  # Todo: Replace with QTimer
+        return self.writer.close()
+
+    def run_process(self):
+        """Start the saving process and wait for its summary, passing the abort request on."""
+        abort_event = mp.Event()
+        result_queue = mp.Queue()
+        process = mp.Process(target=stack_writer.run_writer_process,
+                             args=(self.writer, self.frame_buffer, abort_event, result_queue), daemon=True)
+        process.start()
+        result = None
+        while result is None:
+            if self.parent_window.abort_pressed:
+                abort_event.set()
+            try:
+                result = result_queue.get(timeout=0.05)
+            except queue.Empty:
+                if not process.is_alive():
+                    self.logger.error(f"Saving process exited with code {process.exitcode}")
+                    result = (0, 0, 0)
+        process.join()
+        self.parent_window.worker_grabbing.frame_buffer = None  # never put frames into a freed buffer
+        self.frame_buffer.close(unlink=True)
+        self.frame_buffer = None
+        return result
+
 
 if __name__ == '__main__':
     app = QtWidgets.QApplication(sys.argv)
@@ -33,13 +33,16 @@ config = {
     # next 2 settings matter only if 'trig_out_kind': 'PROGRAMMABLE'
     'trig_out_source':  'MASTER_PULSE', # 'READOUT_END', 'VSYNC', 'MASTER_PULSE'.
     'trig_out_duration_s': 0.001,
-    'trig_out_polarity': 'POSITIVE'  # 'POSITIVE', 'NEGATIVE'
+    'trig_out_polarity': 'POSITIVE',  # 'POSITIVE', 'NEGATIVE'
     # end of trigger_out block
+    'property_cache_dir': './config'  # property metadata saved per camera model and serial, None to disable
 }
 
 import ctypes
 import ctypes.util
 import numpy
+import os
+import json
 
 # for debugging
 import sys
@@ -82,7 +85,10 @@ DCAMWAIT_TIMEOUT_INFINITE = int("0x80000000", 0)
 
 DCAM_DEFAULT_ARG = 0
 
+DCAM_IDSTR_CAMERAID = int("0x04000102", 0)
 DCAM_IDSTR_MODEL = int("0x04000104", 0)
+DCAM_IDSTR_CAMERAVERSION = int("0x04000105", 0)
+DCAM_IDSTR_DRIVERVERSION = int("0x04000106", 0)
 
 DCAMCAP_TRANSFERKIND_FRAME = 0
 
@@ -156,6 +162,14 @@ class DCAMBUF_ATTACH(ctypes.Structure):
             ("buffer", ctypes.POINTER(ctypes.c_void_p)),
             ("buffercount", ctypes.c_int32)]
 
+## DCAM_TIMESTAMP
+#
+# The dcam frame time stamp structure
+#
+class DCAM_TIMESTAMP(ctypes.Structure):
+    _fields_ = [("sec", ctypes.c_uint32),
+            ("microsec", ctypes.c_int32)]
+
 ## DCAMBUF_FRAME
 #
 # The dcam buffer frame structure
@@ -172,7 +186,7 @@ class DCAMBUF_FRAME(ctypes.Structure):
             ("height", ctypes.c_int32),
             ("left", ctypes.c_int32),
             ("top", ctypes.c_int32),
-            ("timestamp", ctypes.c_int32),
+            ("timestamp", DCAM_TIMESTAMP),
             ("framestamp", ctypes.c_int32),
             ("camerastamp", ctypes.c_int32)]
 
@@ -274,8 +288,11 @@ class HamamatsuCamera(object):
     This version uses the Hamamatsu library to allocate camera buffers.
     Storage for the data from the camera is allocated dynamically and
     copied out of the camera buffers.
+    Static property metadata (ids, types, RW flags, text options) is kept in memory,
+    and saved to disk per camera model and serial if property_cache_dir is given.
+    Property ranges are always queried, because they depend on other settings (e.g. subarray).
     """
-    def __init__(self, camera_id = None, **kwds):
+    def __init__(self, camera_id = None, property_cache_dir = None, **kwds):
         """
         Open the connection to the camera specified by camera_id.
         """
@@ -290,8 +307,13 @@ class HamamatsuCamera(object):
         self.frame_y = 0
         self.last_frame_number = 0
         self.properties = None
+        self.prop_attributes = {}
+        self.prop_text = {}
+        self.property_cache_path = self.camera_info = None
+        self.property_cache_dirty = False  # metadata queried since the cache file was saved
         self.max_backlog = 0
         self.number_image_buffers = 0
+        self.warn_overrun = True
 
         self.acquisition_mode = "run_till_abort"
         self.number_frames = 0
@@ -314,14 +336,25 @@ class HamamatsuCamera(object):
                 "dcamwait_open")
         self.wait_handle = ctypes.c_void_p(paramwait.hwait)
 
-        # Get camera properties.
-        self.properties = self.getCameraProperties()
+        # Get camera properties, from the cache file if it matches this camera.
+        if property_cache_dir is not None:
+            self.camera_info = {'model': self.camera_model,
+                                'serial': self.getIdString(camera_id, DCAM_IDSTR_CAMERAID),
+                                'camera_version': self.getIdString(camera_id, DCAM_IDSTR_CAMERAVERSION),
+                                'driver_version': self.getIdString(camera_id, DCAM_IDSTR_DRIVERVERSION)}
+            file_name = "dcam_properties_" + "_".join([self.camera_info['model'], self.camera_info['serial']])
+            file_name = "".join([c if c.isalnum() else "_" for c in file_name]) + ".json"
+            self.property_cache_path = os.path.join(property_cache_dir, file_name)
+        if not self.loadPropertyCache():
+            self.properties = self.getCameraProperties()
+            self.property_cache_dirty = True
 
         # Get camera max width, height.
         # self.max_width = self.getPropertyValue("image_width")[0]
         # self.max_height = self.getPropertyValue("image_height")[0]
         self.max_width = self.getPropertyValue("image_width")
         self.max_height = self.getPropertyValue("image_height")
+        self.savePropertyCache()
 
 
     def captureSetup(self):
@@ -416,14 +449,8 @@ class HamamatsuCamera(object):
         """
         frames = []
         for n in self.newFrames():
-            paramlock = DCAMBUF_FRAME(
-                    0, 0, 0, n, None, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-            paramlock.size = ctypes.sizeof(paramlock)
-
             # Lock the frame in the camera buffer & get address.
-            self.checkStatus(dcam.dcambuf_lockframe(self.camera_handle,
-                                                ctypes.byref(paramlock)),
-                             "dcambuf_lockframe")
+            paramlock = self.lockFrame(n)
 
             # Create storage for the frame & copy into this storage.
             hc_data = HCamData(self.frame_bytes)
@@ -432,16 +459,61 @@ class HamamatsuCamera(object):
 
         return [frames, [self.frame_y, self.frame_x]]
 
+    def getLastFrame(self):
+        """
+        Copy only the newest of the available frames, skip the older ones (e.g. for live view).
+        Returns None if no new frames arrived.
+        This will block waiting for at least one new frame.
+        """
+        new_frames = self.newFrames()
+        if len(new_frames) == 0:
+            return None
+        return self.getFrame(new_frames[-1])
+
+    def lockFrame(self, frame_id):
+        """
+        Lock the frame in the camera buffer, return its DCAMBUF_FRAME (address, time stamp etc.).
+        """
+        paramlock = DCAMBUF_FRAME(
+                0, 0, 0, frame_id, None, 0, 0, 0, 0, 0, 0, DCAM_TIMESTAMP(0, 0), 0, 0)
+        paramlock.size = ctypes.sizeof(paramlock)
+        self.checkStatus(dcam.dcambuf_lockframe(self.camera_handle,
+                                            ctypes.byref(paramlock)),
+                         "dcambuf_lockframe")
+        return paramlock
+
+    def getFrame(self, frame_id):
+        """
+        Copy the frame frame_id out of the camera buffer, as 2D array.
+        """
+        paramlock = self.lockFrame(frame_id)
+        hc_data = HCamData(self.frame_bytes)
+        hc_data.copyData(paramlock.buf)
+        return numpy.reshape(hc_data.getData(), (self.frame_y, self.frame_x))
+
+    def getFrameTimestamp(self, frame_id):
+        """
+        Time stamp of the frame frame_id in the camera buffer, s, without copying the frame.
+        The time stamp is taken by the DCAM driver, in its own clock.
+        """
+        timestamp = self.lockFrame(frame_id).timestamp
+        return timestamp.sec + 1e-6 * timestamp.microsec
+
     def getModelInfo(self, camera_id):
         """
         Returns the model of the camera
         """
+        return self.getIdString(camera_id, DCAM_IDSTR_MODEL)
 
-        c_buf_len = 20
+    def getIdString(self, camera_id, id_str):
+        """
+        Returns the camera information string, e.g. DCAM_IDSTR_MODEL, DCAM_IDSTR_CAMERAID (serial number).
+        """
+        c_buf_len = 64
         string_value = ctypes.create_string_buffer(c_buf_len)
         paramstring = DCAMDEV_STRING(
                         0,
-                        DCAM_IDSTR_MODEL,
+                        id_str,
                         ctypes.cast(string_value, ctypes.c_char_p),
                         c_buf_len)
         paramstring.size = ctypes.sizeof(paramstring)
@@ -459,11 +531,68 @@ class HamamatsuCamera(object):
         """
         return self.properties
 
+    def loadPropertyCache(self):
+        """
+        Load property ids, attribute flags and text options from the cache file.
+        The file is used only if it was saved for the same camera (model, serial, versions),
+        and a property id from it is confirmed by the camera.
+        Returns True if the cache was loaded.
+        """
+        if self.property_cache_path is None or not os.path.exists(self.property_cache_path):
+            return False
+        try:
+            with open(self.property_cache_path, 'r') as f:
+                cache = json.load(f)
+            if cache['camera'] != self.camera_info:
+                return False
+            c_buf_len = 64
+            c_buf = ctypes.create_string_buffer(c_buf_len)
+            self.checkStatus(dcam.dcamprop_getname(self.camera_handle,
+                                                   ctypes.c_int32(cache['properties']['image_width']),
+                                                   c_buf,
+                                                   ctypes.c_int32(c_buf_len)),
+                             "dcamprop_getname")
+            if convertPropertyName(c_buf.value.decode(self.encoding)) != "image_width":
+                return False
+            self.properties = cache['properties']
+            self.prop_attributes = cache['attributes']
+            self.prop_text = cache['text']
+        except (ValueError, KeyError, DCAMException):
+            return False
+        return True
+
+    def savePropertyCache(self):
+        """
+        Save property ids, attribute flags and text options known so far into the cache file,
+        if anything was queried from the camera since the last save. Called after init and on shutdown,
+        metadata looked up in between only marks the cache dirty.
+        """
+        if self.property_cache_path is None or not self.property_cache_dirty:
+            return
+        cache = {'camera': self.camera_info,
+                 'properties': self.properties,
+                 'attributes': self.prop_attributes,
+                 'text': self.prop_text}
+        try:
+            with open(self.property_cache_path, 'w') as f:
+                json.dump(cache, f, indent=1)
+            self.property_cache_dirty = False
+        except OSError as e:
+            print("could not save camera property cache:", e)
+
+    def getPropertyFlags(self, property_name):
+        """
+        Return the attribute flags (type, RW, text) of a property. These do not change,
+        so they are queried from the camera only once.
+        """
+        if property_name not in self.prop_attributes:
+            self.prop_attributes[property_name] = self.getPropertyAttribute(property_name).attribute
+            self.property_cache_dirty = True
+        return self.prop_attributes[property_name]
+
     def getPropertyAttribute(self, property_name):
         """
         Return the attribute structure of a particular property.
-
-        FIXME (OPTIMIZATION): Keep track of known attributes?
         """
         p_attr = DCAMPROP_ATTR()
         p_attr.cbSize = ctypes.sizeof(p_attr)
@@ -492,17 +621,17 @@ class HamamatsuCamera(object):
         """
         Return if a property is readable / writeable.
         """
-        prop_attr = self.getPropertyAttribute(property_name)
+        prop_flags = self.getPropertyFlags(property_name)
         rw = []
 
         # Check if the property is readable.
-        if (prop_attr.attribute & DCAMPROP_ATTR_READABLE):
+        if (prop_flags & DCAMPROP_ATTR_READABLE):
             rw.append(True)
         else:
             rw.append(False)
 
         # Check if the property is writeable.
-        if (prop_attr.attribute & DCAMPROP_ATTR_WRITABLE):
+        if (prop_flags & DCAMPROP_ATTR_WRITABLE):
             rw.append(True)
         else:
             rw.append(False)
@@ -513,6 +642,8 @@ class HamamatsuCamera(object):
         """
         #Return the text options of a property (if any).
         """
+        if property_name in self.prop_text:
+            return self.prop_text[property_name]
         prop_attr = self.getPropertyAttribute(property_name)
         if not (prop_attr.attribute & DCAMPROP_ATTR_HASVALUETEXT):
             return {}
@@ -551,6 +682,8 @@ class HamamatsuCamera(object):
                 if (ret != 1):
                     done = True
 
+            self.prop_text[property_name] = text_options
+            self.property_cache_dirty = True
             return text_options
 
     def getPropertyValue(self, property_name):
@@ -565,7 +698,7 @@ class HamamatsuCamera(object):
         prop_id = self.properties[property_name]
 
         # Get the property attributes.
-        prop_attr = self.getPropertyAttribute(property_name)
+        prop_flags = self.getPropertyFlags(property_name)
 
         # Get the property value.
         c_value = ctypes.c_double(0)
@@ -575,7 +708,7 @@ class HamamatsuCamera(object):
                          "dcamprop_getvalue")
 
         # Convert type based on attribute type.
-        temp = prop_attr.attribute & DCAMPROP_TYPE_MASK
+        temp = prop_flags & DCAMPROP_TYPE_MASK
         if (temp == DCAMPROP_TYPE_MODE):
             prop_type = "MODE"
             prop_value = int(c_value.value)
@@ -649,7 +782,7 @@ class HamamatsuCamera(object):
         # Check that we have not acquired more frames than we can store in our buffer.
         # Keep track of the maximum backlog.
         backlog = cur_frame_number - self.last_frame_number
-        if backlog > self.number_image_buffers:
+        if backlog > self.number_image_buffers and self.warn_overrun:
             print(">> Warning! hamamatsu camera frame buffer overrun detected!")
         if (backlog > self.max_backlog):
             self.max_backlog = backlog
@@ -727,13 +860,39 @@ class HamamatsuCamera(object):
         else:
             self.setPropertyValue("subarray_mode", "ON")
 
+    def setSubArrayRows(self, v_pos, v_size, row_step = 4):
+        """
+        Read out only the band of sensor rows [v_pos, v_pos + v_size), at full width.
+        The band is widened to multiples of row_step, as required by the sensor, and clipped to the sensor.
+        Sub-array mode is switched on, or off if the band is the whole sensor.
+        Takes effect at the next startAcquisition().
+        Returns the actual (v_pos, v_size).
+        """
+        sensor_height = self.max_height[0]
+        v_end = min(sensor_height, int(numpy.ceil((v_pos + v_size) / row_step)) * row_step)
+        v_pos = max(0, int(v_pos) // row_step * row_step)
+        v_size = v_end - v_pos
+        # vpos and vsize are used by the camera only in sub-array mode
+        self.setPropertyValue("subarray_mode", "ON")
+        # shrink before moving, so that the band stays within the sensor at every step
+        if v_size < self.getPropertyValue("subarray_vsize")[0]:
+            self.setPropertyValue("subarray_vsize", v_size)
+            self.setPropertyValue("subarray_vpos", v_pos)
+        else:
+            self.setPropertyValue("subarray_vpos", v_pos)
+            self.setPropertyValue("subarray_vsize", v_size)
+        if v_size == sensor_height and self.getPropertyValue("subarray_hsize")[0] == self.max_width[0]:
+            self.setPropertyValue("subarray_mode", "OFF")
+        return v_pos, v_size
+
     def setACQMode(self, mode, number_frames = None):
         '''
         Set the acquisition mode to either run until aborted or to
         stop after acquiring a set number of frames.
         mode should be either "fixed_length" or "run_till_abort"
         if mode is "fixed_length", then number_frames indicates the number
-        of frames to acquire.
+        of frames to acquire. If mode is "run_till_abort", number_frames sets
+        the size of the ring buffer (10 seconds of frames by default).
         '''
 
         if self.acquisition_mode is "fixed_length" or \
@@ -767,7 +926,10 @@ class HamamatsuCamera(object):
         # number of frames for a fixed length acquisition
         #
         if self.acquisition_mode is "run_till_abort":
-            n_buffers = int(10 * self.getPropertyValue("internal_frame_rate")[0])
+            if self.number_frames:
+                n_buffers = self.number_frames
+            else:
+                n_buffers = int(10 * self.getPropertyValue("internal_frame_rate")[0])
         elif self.acquisition_mode is "fixed_length":
             n_buffers = self.number_frames
         self.number_image_buffers = n_buffers
@@ -795,6 +957,7 @@ class HamamatsuCamera(object):
         """
         Close down the connection to the camera.
         """
+        self.savePropertyCache()
         self.checkStatus(dcam.dcamwait_close(self.wait_handle), "dcamwait_close")
         self.checkStatus(dcam.dcamdev_close(self.camera_handle), "dcamdev_close")
         self.checkStatus(dcam.dcamapi_uninit(), "dcamapi_uninit")
@@ -939,6 +1102,7 @@ class HamamatsuCameraMR(HamamatsuCamera):
 import widget as wd
 import numpy as np
 import logging
+import time
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import pyqtSignal
 logging.basicConfig()
@@ -961,6 +1125,8 @@ class CamController(QtCore.QObject):
         self.frame_readout_ms = 10.0
         self.trigger_in = self.config['trigger_in']
         self.trigger_out = self.config['trigger_out']
+        self.live_running = False
+        self._property_cache = {}  # last values sent to the camera, to skip redundant DCAM calls
         self.logger = logging.getLogger(logger_name)
         self.logger.setLevel(logging.DEBUG)
         # GUI setup
@@ -983,7 +1149,9 @@ class CamController(QtCore.QObject):
                     self.logger.fatal(f"DCAM initialization failed with error code {error_code}")
                 n_cameras = param_init.iDeviceCount
                 if n_cameras > 0:
-                    self.dev_handle = HamamatsuCamera(camera_id=0)
+                    self.dev_handle = HamamatsuCamera(camera_id=0,
+                                                      property_cache_dir=self.config['property_cache_dir'])
+                    self._property_cache = {}
                     self.logger.info(f"Connected to Camera 0, model {self.dev_handle.getModelInfo(0)}")
                     self.status = 'Connected'
                     self.setup()
@@ -997,8 +1165,8 @@ class CamController(QtCore.QObject):
         elif self.dev_handle is not None:
             min_exposure_time = self.dev_handle.getPropertyValue("timing_readout_time")[0]
             if min_exposure_time <= self.exposure_ms/1000.:
-                self.dev_handle.setPropertyValue("exposure_time", self.exposure_ms/1000.)
-                self.dev_handle.setPropertyValue("readout_speed", 2)
+                self._set_property("exposure_time", self.exposure_ms/1000.)
+                self._set_property("readout_speed", 2)
                 # self.logger.debug(f"Camera exposure time, ms: {self.exposure_ms}")
                 self.setup_triggers()
             else:
@@ -1007,6 +1175,15 @@ class CamController(QtCore.QObject):
         else:
             self.logger.error("Camera handle empty")
 
+    def _set_property(self, prop_name, value):
+        """Send the property value to the camera only if it differs from the last value sent."""
+        if self._property_cache.get(prop_name) != value:
+            value_set = self.dev_handle.setPropertyValue(prop_name, value)
+            if value_set is False:  # unknown property or text value, retry next time
+                self._property_cache.pop(prop_name, None)
+            else:  # the camera clamps out-of-range values
+                self._property_cache[prop_name] = value_set
+
     def set_exposure(self, exposure_ms):
         self.exposure_ms = exposure_ms
         self.setup()
@@ -1034,16 +1211,16 @@ class CamController(QtCore.QObject):
                 if self.config['trig_in_source'] == 'MASTER_PULSE':
                     dicti = {'CONTINUOUS': 1, 'START': 2, 'BURST': 3}
                     self._set_property_from_dict('master_pulse_mode', dicti)
-                    self.dev_handle.setPropertyValue("master_pulse_burst_times", self.config['master_pulse_burst_times'])
-                    self.dev_handle.setPropertyValue("master_pulse_interval", self.config['master_pulse_interval_s'])
+                    self._set_property("master_pulse_burst_times", self.config['master_pulse_burst_times'])
+                    self._set_property("master_pulse_interval", self.config['master_pulse_interval_s'])
             else:  # reset trigger_in to default values
-                self.dev_handle.setPropertyValue("trigger_mode", 1)  # NORMAL / 1
-                self.dev_handle.setPropertyValue("master_pulse_trigger_source", 2)  # SOFTWARE
-                self.dev_handle.setPropertyValue("trigger_source", 1)  # INTERNAL
-                self.dev_handle.setPropertyValue("trigger_active", 1)  # EDGE / 1
-                self.dev_handle.setPropertyValue("master_pulse_mode", 1)  # CONTINUOUS /1
-                self.dev_handle.setPropertyValue("master_pulse_burst_times", 1)
-                self.dev_handle.setPropertyValue("master_pulse_interval", 0.1)
+                self._set_property("trigger_mode", 1)  # NORMAL / 1
+                self._set_property("master_pulse_trigger_source", 2)  # SOFTWARE
+                self._set_property("trigger_source", 1)  # INTERNAL
+                self._set_property("trigger_active", 1)  # EDGE / 1
+                self._set_property("master_pulse_mode", 1)  # CONTINUOUS /1
+                self._set_property("master_pulse_burst_times", 1)
+                self._set_property("master_pulse_interval", 0.1)
 
             # Trigger OUT
             if self.trigger_out:
@@ -1054,15 +1231,15 @@ class CamController(QtCore.QObject):
                     dicti = {'READOUT_END': 2, 'VSYNC': 3, 'MASTER_PULSE': 6}
                     self._set_property_from_dict('trig_out_source', dicti)
 
-                self.dev_handle.setPropertyValue("output_trigger_period[0]", self.config['trig_out_duration_s'])
+                self._set_property("output_trigger_period[0]", self.config['trig_out_duration_s'])
 
                 dicti = {'NEGATIVE': 1, 'POSITIVE': 2}
                 self._set_property_from_dict('trig_out_polarity', dicti)
             else:  # defaults
-                self.dev_handle.setPropertyValue("output_trigger_kind[0]", 2)
-                self.dev_handle.setPropertyValue("output_trigger_source[0]", 2)
-                self.dev_handle.setPropertyValue("output_trigger_period[0]", 0.001)
-                self.dev_handle.setPropertyValue("output_trigger_polarity[0]", 2)
+                self._set_property("output_trigger_kind[0]", 2)
+                self._set_property("output_trigger_source[0]", 2)
+                self._set_property("output_trigger_period[0]", 0.001)
+                self._set_property("output_trigger_polarity[0]", 2)
         else:
             self.logger.error('Camera handle is empty. Please initialize camera first.')
 
@@ -1097,11 +1274,13 @@ class CamController(QtCore.QObject):
                 dev_prop_name = "output_trigger_polarity[0]"
             else:
                 dev_prop_name = prop_name
-            self.dev_handle.setPropertyValue(dev_prop_name, prop_dict[self.config[prop_name]])
+            self._set_property(dev_prop_name, prop_dict[self.config[prop_name]])
         else:
             self.logger.error(f"{prop_name} mode unknown: {self.config[prop_name]}")
 
     def snap(self):
+        if self.live_running:  # camera is streaming, last_image is kept up to date by get_live_frame()
+            return
         self.setup()
         if self.config['simulation']:
             self.last_image = np.random.randint(100, 200, size=self.config['image_shape'], dtype='uint16')
@@ -1119,17 +1298,50 @@ class CamController(QtCore.QObject):
             self.logger.error("Camera is not initialized!")
             self.last_image = np.random.randint(100, 200, size=self.config['image_shape'], dtype='uint16')
 
+    def start_live(self):
+        """Keep the camera streaming in 'run_till_abort' mode, instead of starting it for every snap."""
+        self.setup()
+        if not self.config['simulation'] and self.dev_handle is not None:
+            self.dev_handle.setACQMode("run_till_abort")
+            self.dev_handle.startAcquisition()
+        self.live_running = True
+
+    def get_live_frame(self):
+        """Update self.last_image with the newest streamed frame, dropping older ones.
+        Returns True if a new frame arrived."""
+        if self.config['simulation'] or self.dev_handle is None:
+            time.sleep(self.exposure_ms / 1000.)
+            self.last_image = np.random.randint(100, 200, size=self.config['image_shape'], dtype='uint16')
+            return True
+        image = self.dev_handle.getLastFrame()
+        if image is not None:
+            self.last_image = image
+            return True
+        else:
+            return False
+
+    def stop_live(self):
+        if self.live_running and not self.config['simulation'] and self.dev_handle is not None:
+            self.dev_handle.stopAcquisition()
+        self.live_running = False
+
     def disconnect(self):
         """Close the connection to camera"""
         if self.dev_handle is not None:
             self.dev_handle.shutdown()
             self.dev_handle = None
+            self._property_cache = {}
             self.logger.info("Camera disconnected")
             self.status = 'Not_connected'
         else:
             self.logger.error("Camera already disconnected")
 
     def set_frame_height(self, new_height):
+        if self.live_running:  # DCAM rejects subarray changes while capturing
+            self.logger.error("Stop the live mode before changing the frame height")
+            if self.gui_on:
+                self.sig_update_gui.emit()
+            return
         self.frame_height_px = int(new_height)
         self.set_readout_time(new_height)
         if self.gui_on:
@@ -1137,8 +1349,8 @@ class CamController(QtCore.QObject):
         if self.dev_handle is not None:
             self.cam_voffset = int((self.config['sensor_shape'][0] - self.frame_height_px) / 2.0)
             img_voffset = int((self.last_image.shape[0] - self.frame_height_px) / 2.0)
-            self.dev_handle.setPropertyValue("subarray_vsize", self.frame_height_px)
-            self.dev_handle.setPropertyValue("subarray_vpos", self.cam_voffset)
+            self._set_property("subarray_vsize", self.frame_height_px)
+            self._set_property("subarray_vpos", self.cam_voffset)
             if (img_voffset >= 0) and (img_voffset + self.frame_height_px < self.last_image.shape[0]):
                 self.last_image = self.last_image[img_voffset:(img_voffset + self.frame_height_px), :]
             else:
@@ -1207,6 +1419,7 @@ class CamController(QtCore.QObject):
     def _update_gui(self):
         self.gui.update_string_field('Status', self.status)
         self.gui.update_numeric_field('Readout time, ms', self.frame_readout_ms)
+        self.gui.update_param('Image height, px', self.frame_height_px)
 
 
 # run if the module is launched as a standalone program
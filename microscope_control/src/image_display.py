@@ -0,0 +1,148 @@
+"""
+Helpers for fast live image display: reduce camera frames to what the screen can show.
+Copyright Nikita Vladimirov, @nvladimus 2020
+"""
+import threading
+import numpy as np
+from scipy import ndimage
+
+
+def decimate_for_display(image, position, view_range, view_size_px, margin=0.25):
+    """
+    Crop the image to the visible part of the view (plus margin), and bin it down to the screen resolution.
+    When zoomed in to less than one image pixel per screen pixel, the crop is shown at full resolution.
+    Parameters:
+        :param image: 2D array (y, x)
+        :param position: (x, y) of the image origin in view coordinates, or None for (0, 0).
+        :param view_range: ((x_min, x_max), (y_min, y_max)) visible in the view, or None for the whole image.
+        :param view_size_px: (width, height) of the view on screen, px.
+        :param margin: float
+            Extra border around the visible region, as fraction of its size, so that panning shows data.
+    Returns
+        (image_binned, (x, y) position of image_binned in view coordinates, bin_factor)
+    """
+    h, w = image.shape
+    x_pos, y_pos = position if position is not None else (0, 0)
+    if view_range is None:
+        c0, c1, r0, r1 = 0, w, 0, h
+        factor = max(1, int(round(min(w / view_size_px[0], h / view_size_px[1]))))
+    else:
+        (x_min, x_max), (y_min, y_max) = view_range
+        dx, dy = margin * (x_max - x_min), margin * (y_max - y_min)
+        c0, c1 = [int(np.clip(v, 0, w)) for v in (np.floor(x_min - dx - x_pos), np.ceil(x_max + dx - x_pos))]
+        r0, r1 = [int(np.clip(v, 0, h)) for v in (np.floor(y_min - dy - y_pos), np.ceil(y_max + dy - y_pos))]
+        if c1 <= c0 or r1 <= r0:  # image is out of view
+            c0, c1, r0, r1 = 0, w, 0, h
+        factor = max(1, int(round(min((x_max - x_min) / view_size_px[0], (y_max - y_min) / view_size_px[1]))))
+    n_rows, n_cols = (r1 - r0) // factor, (c1 - c0) // factor
+    if n_rows == 0 or n_cols == 0:
+        factor, n_rows, n_cols = 1, r1 - r0, c1 - c0
+    if factor == 1:
+        image_binned = image[r0:r1, c0:c1]
+    else:
+        # sum of strided views is much faster than reshape().mean() for small bin factors
+        image_crop = image[r0:r0 + n_rows * factor, c0:c0 + n_cols * factor]
+        image_binned = np.zeros((n_rows, n_cols), dtype=np.float32)
+        for i in range(factor):
+            for j in range(factor):
+                image_binned += image_crop[i::factor, j::factor]
+        image_binned /= factor ** 2
+    return image_binned, (x_pos + c0, y_pos + r0), factor
+
+
+def line_profile(image, position, start, end, width=1.0):
+    """
+    Intensity profile of the full-resolution image along a line, averaged over its width, sampled at 1 image pixel.
+    Parameters:
+        :param image: 2D array (y, x)
+        :param position: (x, y) of the image origin in view coordinates, or None for (0, 0).
+        :param start: (x, y) of the line start, in view coordinates.
+        :param end: (x, y) of the line end, in view coordinates.
+        :param width: float, width of the line, px. Samples across the width are averaged.
+    Returns
+        1D array of length ~ line length in px.
+    """
+    x_pos, y_pos = position if position is not None else (0, 0)
+    start, end = np.asarray(start, dtype=np.float64), np.asarray(end, dtype=np.float64)
+    length = np.hypot(*(end - start))
+    if length < 1:
+        return np.zeros(0)
+    along = (end - start) / length
+    across = np.array([-along[1], along[0]])
+    t = np.arange(int(length))
+    s = np.arange(max(1, int(round(width)))) - (max(1, int(round(width))) - 1) / 2.0
+    x = start[0] + t[:, None] * along[0] + s[None, :] * across[0] - x_pos - 0.5  # pixel i is centered at i + 0.5
+    y = start[1] + t[:, None] * along[1] + s[None, :] * across[1] - y_pos - 0.5
+    samples = ndimage.map_coordinates(image.astype(np.float32), [y, x], order=1, mode='nearest')
+    return samples.mean(axis=1)
+
+
+class FrameMailbox:
+    """
+    Single-slot mailbox for the newest camera frame, shared between acquisition and display threads.
+    Putting a frame overwrites the previous one, so the display can never fall behind or accumulate frames.
+    Frames are stored by reference, not copied.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+        self.n_dropped = 0
+
+    def put(self, image, position=None):
+        with self._lock:
+            if self._item is not None:
+                self.n_dropped += 1
+            self._item = (image, position)
+
+    def take(self):
+        """Return (image, position) of the newest frame, or None if no new frame arrived since the last call."""
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
+
+class SampledHistogram:
+    """
+    Histogram of uint16 frames from a strided subsample, smoothed across frames by exponential moving average.
+    Percentiles are read from the cumulative histogram, so auto-contrast costs O(n_samples + n_bins) per frame
+    instead of sorting the full frame.
+    """
+    def __init__(self, n_bins=2**14, max_value=2**16, n_samples=2**16, smoothing=0.3):
+        """
+        :param n_bins: int
+            Number of bins over [0, max_value).
+        :param max_value: int
+            Upper bound of pixel values, 2**16 for uint16 frames.
+        :param n_samples: int
+            Approximate number of pixels sampled from each frame.
+        :param smoothing: float
+            Weight of the new frame in the moving average, 1.0 means no smoothing.
+        """
+        self.n_bins = n_bins
+        self.max_value = max_value
+        self.bin_width = max_value // n_bins
+        self.n_samples = n_samples
+        self.smoothing = smoothing
+        self.edges = np.arange(n_bins + 1) * self.bin_width
+        self.counts = None
+
+    def update(self, image):
+        """Add a frame to the histogram. Counts are normalized to fractions of pixels."""
+        stride = max(1, int(np.sqrt(image.size / self.n_samples)))
+        sample = image[::stride, ::stride]
+        bin_index = np.minimum(sample.ravel() // self.bin_width, self.n_bins - 1).astype(np.intp)
+        counts = np.bincount(bin_index, minlength=self.n_bins) / bin_index.size
+        if self.counts is None:
+            self.counts = counts
+        else:
+            self.counts += self.smoothing * (counts - self.counts)
+
+    def percentile(self, q):
+        """Pixel value at percentile q (0-100), interpolated within bins. Accepts a scalar or a sequence."""
+        if self.counts is None:
+            raise ValueError("Histogram is empty, call update() first")
+        cdf = np.concatenate(([0.0], np.cumsum(self.counts)))
+        return np.interp(np.asarray(q) / 100.0 * cdf[-1], cdf, self.edges)
+
+    def reset(self):
+        self.counts = None
@@ -0,0 +1,81 @@
+"""
+Pre-flight check of the saving disk(s) before acquisition: free space and sustained write speed.
+Copyright Nikita Vladimirov, @nvladimus 2020
+"""
+import os
+import time
+import shutil
+import numpy as np
+
+
+def data_rate_bytes_s(frame_shape, exposure_ms, bytes_per_px=2):
+    """Data rate of the camera stream, assuming one frame per exposure (stage triggers are exposure-coupled)."""
+    return int(np.prod(frame_shape)) * bytes_per_px * 1000.0 / exposure_ms
+
+
+def benchmark_write_speed(folder, frame_shape, test_size_mb=200):
+    """Write incompressible uint16 frames of frame_shape into a temporary file in folder, flushed to disk.
+    Parameters:
+        :param folder: str
+        :param frame_shape: tuple (height, width) of camera frames, px.
+        :param test_size_mb: int
+            Total amount of data to write, MB.
+    Returns
+        write speed, bytes/s.
+    """
+    frame = np.random.randint(0, 2**16 - 1, size=frame_shape, dtype='uint16')
+    n_frames = max(1, int(test_size_mb * 2**20 / frame.nbytes))
+    path = os.path.join(folder, '.write_speed_test.tmp')
+    try:
+        t_start = time.perf_counter()
+        with open(path, 'wb', buffering=0) as f:
+            for i in range(n_frames):
+                f.write(frame.data)
+            os.fsync(f.fileno())
+        t_elapsed = time.perf_counter() - t_start
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return n_frames * frame.nbytes / t_elapsed
+
+
+def check_disks(folders, n_frames, frame_shape, exposure_ms, margin=1.2, test_size_mb=200):
+    """Check that the folders have enough space for n_frames and can sustain the camera data rate.
+    The data is assumed to be spread evenly over the folders (striped saving).
+    Parameters:
+        :param folders: list of str
+        :param n_frames: int
+            Total number of frames to save.
+        :param frame_shape: tuple (height, width) of camera frames, px.
+        :param exposure_ms: float
+        :param margin: float
+            Required ratio of disk write speed to the camera data rate, and of free space to data volume.
+        :param test_size_mb: int
+            Amount of data written by the speed test, per folder.
+    Returns
+        (ok, messages): (bool, list of str)
+    """
+    n_folders = len(folders)
+    frame_bytes = int(np.prod(frame_shape)) * 2
+    volume_per_disk = n_frames * frame_bytes / n_folders
+    rate_per_disk = data_rate_bytes_s(frame_shape, exposure_ms) / n_folders
+    ok = True
+    messages = [f"Data: {n_frames * frame_bytes / 2**30:.1f} GB total, "
+                f"{rate_per_disk * n_folders / 2**20:.0f} MB/s at {1000.0 / exposure_ms:.1f} fps"]
+    for folder in folders:
+        free_bytes = shutil.disk_usage(folder).free
+        if free_bytes < margin * volume_per_disk:
+            ok = False
+            messages.append(f"{folder}: not enough space, {free_bytes / 2**30:.1f} GB free, "
+                            f"{margin * volume_per_disk / 2**30:.1f} GB needed")
+        speed = benchmark_write_speed(folder, frame_shape, test_size_mb)
+        messages.append(f"{folder}: write speed {speed / 2**20:.0f} MB/s, "
+                        f"needed {margin * rate_per_disk / 2**20:.0f} MB/s")
+        if speed < margin * rate_per_disk:
+            ok = False
+            ratio = speed / (margin * rate_per_disk)
+            max_height = int(frame_shape[0] * ratio) // 4 * 4  # subarray height comes in steps of 4 rows
+            messages.append(f"{folder}: disk too slow. Crop image height to {max_height} px, "
+                            f"increase exposure to {exposure_ms / ratio:.1f} ms, "
+                            f"or add disks to config.saving['root_folder'].")
+    return ok, messages
@@ -0,0 +1,88 @@
+"""
+PSF metrics of beads in the left and right view ROIs, for real-time feedback during DM and light-sheet alignment.
+Uses the metric functions of dm_optimization/lib/optimization.py.
+Copyright Nikita Vladimirov, @nvladimus 2020
+"""
+import collections
+import numpy as np
+import optimization
+
+Metric = collections.namedtuple('Metric', ['method1', 'method2', 'weights_method12', 'weights_fwhm_xy',
+                                           'r2_integration_radius', 'normalize_brightness', 'roi_size',
+                                           'tracking', 'peak_estimate', 'ideal_PSF'])
+
+
+def metric_settings_from_config(settings):
+    """Build the named tuple expected by optimization.get_metric() from a config dictionary."""
+    fields = dict(settings)
+    fields['roi_size'] = (settings['crop_size_px'], settings['crop_size_px'], 1)
+    fields.setdefault('ideal_PSF', None)
+    return Metric(**{key: fields[key] for key in Metric._fields})
+
+
+def measure_beads(crops, metric_settings, fwhm_method='moments', metric_context=None):
+    """
+    FWHM (x, y), peak intensity above background, and the optimization metric of bead crops.
+    Parameters:
+        :param crops: list of 2D arrays of equal shape.
+        :param metric_settings: named tuple from metric_settings_from_config()
+        :param fwhm_method: str
+            'fit' for 2D Gaussian least-squares fit (optimization.fit_gaussian_2d_batch()), or 'moments',
+            'log_parabola' for the fast estimator of optimization.get_FWHM_moments(), both vectorized over crops.
+        :param metric_context: optimization.MetricContext of metric_settings, or None.
+    Returns
+        list of dictionaries with keys 'fwhm_x_px', 'fwhm_y_px', 'peak', 'metric'.
+        Metric is NaN if it cannot be computed for this crop size.
+    """
+    results = [{'peak': float(crop.max() - np.median(crop)), 'metric': np.nan} for crop in crops]
+    if len(crops) == 0:
+        return results
+    crops_normalized = np.array([optimization.normalize_roi(crop) for crop in crops])
+    if fwhm_method == 'fit':
+        _, _, sigma_x, sigma_y, _, _ = optimization.fit_gaussian_2d_batch(crops_normalized)
+    else:
+        _, _, sigma_x, sigma_y = optimization.get_FWHM_moments(crops_normalized, method=fwhm_method)
+    fwhm_x, fwhm_y = optimization.sigma2fwhm(sigma_x), optimization.sigma2fwhm(sigma_y)
+    for i, result in enumerate(results):
+        result['fwhm_x_px'], result['fwhm_y_px'] = fwhm_x[i], fwhm_y[i]
+    try:
+        metrics = optimization.get_metric_batch(np.array(crops), metric_settings, metric_context)
+    except ValueError:
+        metrics = np.full(len(crops), np.nan)
+    for i, result in enumerate(results):
+        result['metric'] = metrics[i]
+    return results
+
+
+def measure_views(image, position, view_rois, settings, metric_settings, metric_context=None):
+    """
+    Find beads in each view ROI and measure their PSF.
+    Parameters:
+        :param image: 2D array (y, x), full resolution camera frame.
+        :param position: (x, y) of the image origin in view coordinates, or None for (0, 0).
+        :param view_rois: dictionary {view name: (x, y, width, height)} of ROIs in view coordinates.
+        :param settings: dictionary, see config.psf_metrics
+        :param metric_settings: named tuple from metric_settings_from_config()
+        :param metric_context: optimization.MetricContext of metric_settings, or None.
+    Returns
+        list of dictionaries, one per bead, with keys 'view', 'x', 'y' (bead center in view coordinates)
+        and those of measure_beads().
+    """
+    x_pos, y_pos = position if position is not None else (0, 0)
+    half = settings['crop_size_px'] // 2
+    results, crops = [], []
+    for view, (x, y, w, h) in view_rois.items():
+        c0, r0 = max(0, int(x - x_pos)), max(0, int(y - y_pos))
+        c1, r1 = min(image.shape[1], int(x + w - x_pos)), min(image.shape[0], int(y + h - y_pos))
+        if (c1 - c0) <= 2 * half or (r1 - r0) <= 2 * half:
+            continue
+        view_image = image[r0:r1, c0:c1]
+        peaks = optimization.find_beads(view_image, settings['n_beads_per_view'], settings['min_separation_px'],
+                                        half, settings['threshold_sigmas'], settings['min_snr'])
+        for y_peak, x_peak in peaks:
+            crops.append(view_image[y_peak - half:y_peak + half, x_peak - half:x_peak + half])
+            results.append({'view': view, 'x': x_pos + c0 + x_peak + 0.5, 'y': y_pos + r0 + y_peak + 0.5})
+    measurements = measure_beads(crops, metric_settings, settings['fwhm_method'], metric_context)
+    for bead, measurement in zip(results, measurements):
+        bead.update(measurement)
+    return results
@@ -0,0 +1,288 @@
+"""
+Writing camera frames into BigDataViewer (H5/XML) stacks, independent of the GUI.
+The same writer runs either in a saving thread, or in a separate saving process
+which receives frames through a shared-memory ring buffer.
+Copyright Nikita Vladimirov, @nvladimus 2020
+"""
+import os
+import numpy as np
+import multiprocessing as mp
+import queue
+import h5py
+import npy2bdv
+try:
+    from multiprocessing import shared_memory  # Python >= 3.8
+except ImportError:
+    shared_memory = None
+
+
+class BdvStackWriter:
+    """
+    Sort incoming planes into stacks (time, tile, angle) and append them to a BDV H5 file.
+    The object holds only plain parameters until open() is called, so it can be pickled
+    and sent to another process.
+    """
+    def __init__(self, file_path, frames_to_save, frames_per_stack, n_angles, n_tiles, image_shape,
+                 planes_interleaved=True, z_voxel_size_um=1.0, um_per_px=1.0, tile_step_um=0.0,
+                 y_stage_flip=False, exposure_ms=0, camera_name="OrcaFlash 4.3"):
+        """
+        Parameters:
+            :param file_path: str
+                Path of the output file, without extension.
+            :param image_shape: tuple
+                (height, width) of the camera frame, px.
+            :param planes_interleaved: bool
+                If True, planes come from L,R,L,R,.. views, otherwise from L,L,...,R,R,.. views.
+        """
+        self.file_path = file_path
+        self.frames_to_save = frames_to_save
+        self.frames_per_stack = frames_per_stack
+        self.n_angles = n_angles
+        self.n_tiles = n_tiles
+        self.image_shape = tuple(image_shape)
+        self.planes_interleaved = planes_interleaved
+        self.um_per_px = um_per_px
+        self.tile_step_um = tile_step_um
+        self.y_stage_flip = y_stage_flip
+        self.exposure_ms = exposure_ms
+        self.camera_name = camera_name
+        z_anisotropy = z_voxel_size_um / um_per_px
+        self.unshear_matrix_L = np.array(((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, -z_anisotropy, 0.0), (0.0, 0.0, 1.0, 0.0)))
+        self.unshear_matrix_R = np.array(((1.0, 0.0, 0.0, 0.0), (0.0, 1.0, z_anisotropy, 0.0),  (0.0, 0.0, 1.0, 0.0)))
+        self.voxel_size = (um_per_px, um_per_px, z_voxel_size_um)
+        self.frame_counter = self.stack_counter = self.angle_counter = 0
+        self.tile_counter = self.tile_counter_new = 0
+        self.time_index = 0
+        self.plane_index_L = self.plane_index_R = -1
+        self.bdv_writer = None
+
+    def open(self):
+        """Create the H5 file. Must be called in the process which writes the data."""
+        self.bdv_writer = npy2bdv.BdvWriter(self.file_path + '.h5', nangles=self.n_angles, ntiles=self.n_tiles)
+
+    def _append_view(self, angle, m_affine, name_affine):
+        self.bdv_writer.append_view(None,
+                                    virtual_stack_dim=(self.frames_per_stack,) + self.image_shape,
+                                    time=self.time_index,
+                                    angle=angle,
+                                    tile=self.tile_counter,
+                                    m_affine=m_affine,
+                                    name_affine=name_affine,
+                                    voxel_size_xyz=self.voxel_size,
+                                    exposure_time=self.exposure_ms
+                                    )
+
+    def _append_plane(self, plane, z):
+        self.bdv_writer.append_plane(plane=plane, z=z, time=self.time_index,
+                                     tile=self.tile_counter, angle=self.angle_counter)
+
+    def write_plane(self, plane):
+        """Append the next plane (2D array of image_shape) to its stack, opening new stacks as needed."""
+        if not self.planes_interleaved:  # planes are from L,L,L,L..., R,R,R,.. views
+            if self.frame_counter % self.frames_per_stack == 0:  # begin new stack
+                self.time_index = int(self.stack_counter / self.n_angles / self.n_tiles)
+                self.plane_index_L = self.plane_index_R = -1
+                self.angle_counter = self.angle_counter % self.n_angles
+                if self.tile_counter_new > self.tile_counter:
+                    self.tile_counter = self.tile_counter_new
+                self._append_view(self.angle_counter, self.unshear_matrix_L, "unshearing transformation")
+                self.stack_counter += 1
+                if self.n_tiles > 1:
+                    self.tile_counter_new = self.tile_counter + 1
+        else:  # planes interleaved, from L, R, L, R, .. views
+            if self.frame_counter % (self.n_angles * self.frames_per_stack) == 0:  # begin 2 new stacks
+                self.time_index = int(self.stack_counter / self.n_angles / self.n_tiles)
+                self.plane_index_L = self.plane_index_R = -1
+                if self.tile_counter_new > self.tile_counter:
+                    self.tile_counter = self.tile_counter_new
+                self._append_view(0, self.unshear_matrix_L, "unshearing")
+                self._append_view(1, self.unshear_matrix_R, "unshearing")
+                if self.n_tiles > 1:
+                    self.tile_counter_new = self.tile_counter + 1
+                self.stack_counter += 2
+            self.angle_counter = self.frame_counter % self.n_angles  # -> angle 0/1 for even/odd plane
+        # common block for both plane interleave modes:
+        if self.angle_counter % self.n_angles == 0:
+            self.plane_index_L += 1
+            plane_index = self.plane_index_L
+        else:
+            self.plane_index_R += 1
+            plane_index = self.plane_index_R
+        self._append_plane(plane, plane_index)
+        self.frame_counter += 1
+
+    def close(self):
+        """Write XML file with tile coordinates, close the H5 file.
+        Returns
+            (n_frames_saved, n_timepoints, n_stacks)
+        """
+        ntimes = int(self.stack_counter / self.n_angles / self.n_tiles)
+        self.bdv_writer.write_xml_file(ntimes=ntimes, camera_name=self.camera_name)
+        # write tile coordinates into XML
+        for it in range(ntimes):
+            stage_sign = -1 if self.y_stage_flip else 1
+            tile_offset_px = stage_sign * self.tile_step_um / self.um_per_px
+            for itile in range(self.n_tiles):
+                translation_angle0 = np.array(((1.0, 0, 0, tile_offset_px * itile), (0, 1.0, 0, 0),  (0, 0, 1.0, 0)))
+                translation_angle1 = np.array(((1.0, 0, 0, -tile_offset_px * itile), (0, 1.0, 0, 0),  (0, 0, 1.0, 0)))
+                self.bdv_writer.append_affine(m_affine=translation_angle0, time=it, tile=itile, angle=0)
+                self.bdv_writer.append_affine(m_affine=translation_angle1, time=it, tile=itile, angle=1)
+        self.bdv_writer.close()
+        return self.frame_counter, ntimes, self.stack_counter
+
+
+class StripedBdvStackWriter(BdvStackWriter):
+    """
+    Distribute stacks round-robin over several H5 part files (one per disk), so that
+    the sustained write bandwidth adds up over the drives.
+    The master H5 file holds the view metadata and external links to the stacks in the part files,
+    so the master XML opens in BigDataViewer/BigStitcher as a single dataset.
+    """
+    def __init__(self, file_path, part_paths, *args, stripe_by='angle', **kwargs):
+        """
+        Parameters:
+            :param file_path: str
+                Path of the master file, without extension.
+            :param part_paths: list of str
+                Paths of the part files (one per disk), without extension.
+            :param stripe_by: str
+                'angle', 'tile', or 'stack': which counter selects the part file for a new stack.
+            Other parameters are the same as in BdvStackWriter.
+        """
+        super().__init__(file_path, *args, **kwargs)
+        assert stripe_by in ('angle', 'tile', 'stack'), f"Unknown stripe_by value: {stripe_by}"
+        self.part_paths = list(part_paths)
+        self.stripe_by = stripe_by
+        self.part_writers = []
+        self.view_parts = {}  # (time, tile, angle) -> index of part file
+        self.n_views = 0
+
+    def open(self):
+        super().open()
+        self.part_writers = [npy2bdv.BdvWriter(path + '.h5', nangles=self.n_angles, ntiles=self.n_tiles)
+                             for path in self.part_paths]
+
+    def _append_view(self, angle, m_affine, name_affine):
+        # master view stays empty (no chunks allocated), and is linked to the part file on close()
+        super()._append_view(angle, m_affine, name_affine)
+        if self.stripe_by == 'angle':
+            i_part = angle % len(self.part_writers)
+        elif self.stripe_by == 'tile':
+            i_part = self.tile_counter % len(self.part_writers)
+        else:
+            i_part = self.n_views % len(self.part_writers)
+        self.view_parts[(self.time_index, self.tile_counter, angle)] = i_part
+        self.n_views += 1
+        self.part_writers[i_part].append_view(None,
+                                              virtual_stack_dim=(self.frames_per_stack,) + self.image_shape,
+                                              time=self.time_index, angle=angle, tile=self.tile_counter)
+
+    def _append_plane(self, plane, z):
+        i_part = self.view_parts[(self.time_index, self.tile_counter, self.angle_counter)]
+        self.part_writers[i_part].append_plane(plane=plane, z=z, time=self.time_index,
+                                               tile=self.tile_counter, angle=self.angle_counter)
+
+    def close(self):
+        """Close the part files, write the master XML and link the master H5 views to the part files."""
+        for part in self.part_writers:
+            part.close()
+        summary = super().close()
+        master_h5 = self.file_path + '.h5'
+        with h5py.File(master_h5, 'a') as f:
+            for (itime, itile, iangle), i_part in self.view_parts.items():
+                group_name = 't{:05d}/s{:02d}'.format(itime, itile * self.n_angles + iangle)
+                del f[group_name]
+                f[group_name] = h5py.ExternalLink(self._link_path(self.part_paths[i_part] + '.h5', master_h5),
+                                                  '/' + group_name)
+        return summary
+
+    @staticmethod
+    def _link_path(part_h5, master_h5):
+        """Relative path if possible, absolute if the part is on another drive."""
+        try:
+            return os.path.relpath(part_h5, os.path.dirname(os.path.abspath(master_h5)))
+        except ValueError:
+            return os.path.abspath(part_h5)
+
+
+class SharedFrameBuffer:
+    """
+    Ring buffer of camera frames in shared memory (multiprocessing.shared_memory).
+    The frames are copied once into a free slot by the grabbing thread, and only slot indices
+    are passed between the processes, via two queues (free and filled slots).
+    """
+    def __init__(self, n_slots, frame_shape, dtype='uint16'):
+        if shared_memory is None:
+            raise RuntimeError("multiprocessing.shared_memory requires Python 3.8 or newer")
+        self.n_slots = n_slots
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=n_slots * int(np.prod(self.frame_shape)) * self.dtype.itemsize)
+        self.frames = np.ndarray((n_slots,) + self.frame_shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.free_slots = mp.Queue()
+        self.filled_slots = mp.Queue()
+        for i in range(n_slots):
+            self.free_slots.put(i)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['frames']  # re-attached by name in the other process, never copied
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.frames = np.ndarray((self.n_slots,) + self.frame_shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def put(self, frame, timeout=1.0):
+        """Copy frame into the next free slot and pass its index to the consumer.
+        Returns False if no slot became free within timeout (frame dropped)."""
+        try:
+            slot = self.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        np.copyto(self.frames[slot], np.reshape(frame, self.frame_shape))
+        self.filled_slots.put(slot)
+        return True
+
+    def get(self, timeout=0.1):
+        """Return the index of the oldest filled slot, or None at the end of stream.
+        Raises queue.Empty if nothing arrived within timeout."""
+        return self.filled_slots.get(timeout=timeout)
+
+    def release(self, slot):
+        """Return the slot to the pool of free slots."""
+        self.free_slots.put(slot)
+
+    def end_stream(self):
+        """Tell the consumer that no more frames will come, e.g. when grabbing stopped early."""
+        self.filled_slots.put(None)
+
+    def close(self, unlink=False):
+        """Detach from shared memory. The creating process frees it with unlink=True."""
+        del self.frames
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def run_writer_process(writer, frame_buffer, abort_event, result_queue):
+    """Entry point of the saving process: drain the shared frame buffer into the writer.
+    Parameters:
+        :param writer: BdvStackWriter, not opened yet.
+        :param frame_buffer: SharedFrameBuffer
+        :param abort_event: multiprocessing.Event, set by the GUI to stop saving.
+        :param result_queue: multiprocessing.Queue, receives the output of writer.close().
+    """
+    writer.open()
+    while not abort_event.is_set() and writer.frame_counter < writer.frames_to_save:
+        try:
+            slot = frame_buffer.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if slot is None:
+            break
+        writer.write_plane(frame_buffer.frames[slot])
+        frame_buffer.release(slot)
+    result_queue.put(writer.close())
+    frame_buffer.close()
@@ -221,6 +221,16 @@ class MotionController(QtCore.QObject):
         if self.gui_on:
             self.sig_update_gui.emit()
 
+    def scan_line_positions(self):
+        """Stage positions (x, y) of the scan lines in scan order, mm: x at the center of the line,
+        y evenly spaced between y_start and y_stop, as in the SCANV command."""
+        x_center = 0.5 * (self.scan_limits_xx_yy[0] + self.scan_limits_xx_yy[1])
+        y_start, y_stop = self.scan_limits_xx_yy[2], self.scan_limits_xx_yy[3]
+        if self.n_scan_lines < 2:
+            return [(x_center, y_start)]
+        y_step = (y_stop - y_start) / (self.n_scan_lines - 1)
+        return [(x_center, y_start + i * y_step) for i in range(self.n_scan_lines)]
+
     def _setup_scan(self):
         """Send the scan parameters to the stage"""
         # set x-limits and trigger interval